@@ -2,39 +2,66 @@
 import os
 import json
 import uuid
+import base64
+import binascii
 import jwt
+import anyio
+import asyncio
+import queue
+import threading
+import time
+import itertools
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
 from typing import List
 from datetime import datetime, timedelta
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
 from jwt import PyJWTError
+from cachetools import TTLCache
 from passlib.context import CryptContext
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Request, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
 from pydantic import BaseModel, EmailStr, ConfigDict
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, ForeignKey, Table, DateTime, JSON, Text, func
-from sqlalchemy.orm import declarative_base, sessionmaker, Session, relationship
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, Boolean, ForeignKey, Table, DateTime, Date, JSON, Text, LargeBinary, Index, func, select, and_, or_, not_, case, false, tuple_, inspect
+from sqlalchemy.orm import declarative_base, sessionmaker, Session, relationship, make_transient_to_detached
+from sqlalchemy.pool import StaticPool
 import firebase_admin
 from firebase_admin import credentials, firestore, storage
+from photo_variants import render_photo_variants, PHOTO_VARIANT_CONTENT_TYPE
+
+# Started with `python main.py`, the photo pool's spawned workers re-run this file as
+# __mp_main__. They only use photo_variants, so they skip Firebase and database setup.
+IS_PHOTO_WORKER = __name__ == "__mp_main__"
 
 # Initialize Firebase
-# Check if running in production (environment variable exists)
-if os.getenv('FIREBASE_CREDENTIALS'):
-    # Production: Load from environment variable
-    firebase_creds = json.loads(os.getenv('FIREBASE_CREDENTIALS'))
-    cred = credentials.Certificate(firebase_creds)
+if IS_PHOTO_WORKER:
+    firebase_db = firebase_bucket = None
 else:
-    # Local development: Load from file
-    cred = credentials.Certificate("serviceAccountKey.json")
+    # Check if running in production (environment variable exists)
+    if os.getenv('FIREBASE_CREDENTIALS'):
+        # Production: Load from environment variable
+        firebase_creds = json.loads(os.getenv('FIREBASE_CREDENTIALS'))
+        cred = credentials.Certificate(firebase_creds)
+    else:
+        # Local development: Load from file
+        cred = credentials.Certificate("serviceAccountKey.json")
 
-firebase_admin.initialize_app(cred, {
-    'storageBucket': 'fightmatch-45bf4.firebasestorage.app'
-})
+    firebase_admin.initialize_app(cred, {
+        'storageBucket': 'fightmatch-45bf4.firebasestorage.app'
+    })
 
-firebase_db = firestore.client()
-firebase_bucket = storage.bucket()
+    firebase_db = firestore.client()
+    firebase_bucket = storage.bucket()
 
 # Database setup
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./fight_match.db")
@@ -43,14 +70,112 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./fight_match.db")
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
+# Connection pool per worker process. Every request thread (THREADPOOL_SIZE) and
+# background worker can hold a connection, so pool size + overflow bounds how many
+# of them touch the database at once; the rest wait up to DB_POOL_TIMEOUT seconds.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Seconds, stays under server/proxy idle timeouts
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+pool_options = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+}
+
 # Remove connect_args for PostgreSQL compatibility
 if DATABASE_URL.startswith("postgresql://"):
-    engine = create_engine(DATABASE_URL)
+    engine = create_engine(
+        DATABASE_URL,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        **pool_options
+    )
 else:
-    # SQLite needs check_same_thread=False
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    # SQLite needs check_same_thread=False; an in-memory database lives in one connection,
+    # which every thread has to share
+    in_memory = DATABASE_URL in ("sqlite://", "sqlite:///:memory:")
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        **({"poolclass": StaticPool} if in_memory else pool_options)
+    )
+
+    @event.listens_for(engine, "connect")
+    def configure_sqlite_connection(dbapi_connection, connection_record):
+        # WAL lets readers run alongside the writer; busy_timeout waits for locks instead of failing
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# SQLite allows a single writer. Sessions take this lock before their first write and
+# hold it until the transaction ends, so writers queue here instead of failing with
+# "database is locked". The driver only opens a transaction at the first write, so
+# reads never wait. Other processes (migration scripts) are covered by busy_timeout.
+#
+# A thread may only have one writing session at a time: a second session writing on the
+# thread that holds the lock could never get it (nor SQLite's own lock) until the first
+# commits, so it fails straight away instead of waiting out the timeout.
+sqlite_write_lock = threading.Lock()
+sqlite_write_lock_owner = None  # Ident of the thread holding the lock
+sqlite_write_stats = {"acquired": 0, "wait_seconds": 0.0, "timeouts": 0}
+
+
+def acquire_sqlite_write_lock(session: Session):
+    global sqlite_write_lock_owner
+    if session.info.get("holds_sqlite_write_lock"):
+        return
+    if sqlite_write_lock_owner == threading.get_ident():
+        raise RuntimeError(
+            "Another session on this thread holds the SQLite write lock; "
+            "commit it before writing with a second session"
+        )
+    started = time.monotonic()
+    # Give up after the pool timeout and fall back on busy_timeout rather than risk a deadlock
+    acquired = sqlite_write_lock.acquire(timeout=DB_POOL_TIMEOUT)
+    sqlite_write_stats["wait_seconds"] += time.monotonic() - started
+    if acquired:
+        sqlite_write_lock_owner = threading.get_ident()
+        sqlite_write_stats["acquired"] += 1
+        session.info["holds_sqlite_write_lock"] = True
+    else:
+        sqlite_write_stats["timeouts"] += 1
+
+
+def select_for_update(query):
+    """
+    Reload the query's rows and lock them until the transaction ends. SQLite ignores
+    FOR UPDATE, so there the session takes the write lock before reading instead.
+    """
+    if engine.dialect.name == "sqlite":
+        acquire_sqlite_write_lock(query.session)
+    return query.with_for_update().populate_existing()
+
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(SessionLocal, "before_flush")
+    def lock_before_flush(session, flush_context, instances):
+        acquire_sqlite_write_lock(session)
+
+    @event.listens_for(SessionLocal, "do_orm_execute")
+    def lock_before_bulk_write(orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            acquire_sqlite_write_lock(orm_execute_state.session)
+
+    @event.listens_for(SessionLocal, "after_transaction_end")
+    def release_write_lock(session, transaction):
+        global sqlite_write_lock_owner
+        if transaction.parent is None and session.info.pop("holds_sqlite_write_lock", False):
+            sqlite_write_lock_owner = None
+            sqlite_write_lock.release()
+
 Base = declarative_base()
 
 # Security setup
@@ -62,6 +187,15 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 app = FastAPI(title="Fight Match API")
 
+# Sync routes and dependencies (SQLAlchemy, bcrypt, Firestore/Storage clients) run on
+# this many worker threads instead of blocking the event loop
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+
+
+@app.on_event("startup")
+def configure_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
 UPLOAD_DIR = Path("uploads/profile_photos")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -81,6 +215,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Database Models
@@ -120,6 +255,7 @@ class User(Base):
     gender = Column(String, nullable=True)  # Male, Female, Other, Prefer not to say
     latitude = Column(Float, nullable=True)
     longitude = Column(Float, nullable=True)
+    geo_cell = Column(Integer, nullable=True, index=True)  # Grid cell of (latitude, longitude), see geo_cell_for
     availability = Column(JSON, nullable=True)
     last_viewed_matches = Column(DateTime, nullable=True)
     current_title = Column(String, nullable=True)
@@ -145,6 +281,37 @@ class User(Base):
     swipes_made = relationship("Swipe", foreign_keys="Swipe.user_id", back_populates="user")
     swipes_received = relationship("Swipe", foreign_keys="Swipe.target_user_id", back_populates="target_user")
 
+    # Indexed copies of martial_arts / availability, see sync_discover_search_rows
+    style_entries = relationship("UserStyle", cascade="all, delete-orphan")
+    available_days = relationship("UserAvailableDay", cascade="all, delete-orphan")
+
+
+class UserStyle(Base):
+    __tablename__ = "user_styles"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    style = Column(String, primary_key=True)
+
+    __table_args__ = (Index("ix_user_styles_style_user", "style", "user_id"),)
+
+
+class UserAvailableDay(Base):
+    __tablename__ = "user_available_days"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(String, primary_key=True)  # Key from User.availability, e.g. "monday"
+
+    __table_args__ = (Index("ix_user_available_days_day_user", "day", "user_id"),)
+
+
+def sync_discover_search_rows(user: User):
+    """Mirror the martial_arts / availability JSON columns into their indexed lookup tables"""
+    styles = user.martial_arts if isinstance(user.martial_arts, list) else []
+    user.style_entries = [UserStyle(style=style) for style in dict.fromkeys(styles)]
+
+    availability = user.availability if isinstance(user.availability, dict) else {}
+    user.available_days = [UserAvailableDay(day=day) for day, slots in availability.items() if slots]
+
 
 from pydantic import BaseModel, ConfigDict
 from typing import Optional
@@ -155,18 +322,27 @@ class PhotoGallery(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    photo_url = Column(String)
+    photo_url = Column(String)  # Original upload
+    # Resized WebP variants (see photo_variants.PHOTO_VARIANTS); clients should use the smallest that fits
+    thumbnail_url = Column(String, nullable=True)
+    card_url = Column(String, nullable=True)
+    full_url = Column(String, nullable=True)
     is_primary = Column(Integer, default=0)  # Changed from Boolean to Integer for SQLite compatibility
     order_index = Column(Integer, default=0)  # Display order
     uploaded_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", backref="gallery_photos")
 
+    __table_args__ = (Index("ix_photo_gallery_user_order", "user_id", "order_index"),)
+
 
 # Pydantic model for photo gallery
 class PhotoGalleryResponse(BaseModel):
     id: int
     photo_url: str
+    thumbnail_url: Optional[str] = None
+    card_url: Optional[str] = None
+    full_url: Optional[str] = None
     is_primary: bool
     order_index: int
 
@@ -182,6 +358,7 @@ class DiscoverFilters(BaseModel):
     experience_min: Optional[int] = None
     experience_max: Optional[int] = None
     day_of_week: Optional[str] = None  # For availability filtering
+    sort_by: Optional[str] = None  # "distance" for closest fighters first, most compatible first otherwise
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -210,6 +387,9 @@ class Swipe(Base):
     user = relationship("User", foreign_keys=[user_id], back_populates="swipes_made")
     target_user = relationship("User", foreign_keys=[target_user_id], back_populates="swipes_received")
 
+    # One swipe per (user, target); also serves the mutual-like and discover exclusion lookups
+    __table_args__ = (Index("uq_swipes_user_target", "user_id", "target_user_id", unique=True),)
+
 
 class Fight(Base):
     __tablename__ = "fights"
@@ -240,6 +420,41 @@ class FightRecord(Base):
     user = relationship("User", foreign_keys=[user_id])
     opponent = relationship("User", foreign_keys=[opponent_id])
 
+    # History is read as "user_id = :id OR opponent_id = :id ORDER BY date"
+    __table_args__ = (
+        Index("ix_fight_records_user_date", "user_id", "date"),
+        Index("ix_fight_records_opponent_date", "opponent_id", "date"),
+    )
+
+
+class FighterStats(Base):
+    """Per-user streak counters, maintained incrementally as fights are recorded"""
+    __tablename__ = "fighter_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    current_streak = Column(Integer, default=0)
+    longest_streak = Column(Integer, default=0)
+    training_streak = Column(Integer, default=0)  # Consecutive training days ending on last_training_date
+    last_training_date = Column(Date, nullable=True)
+    unique_training_days = Column(Integer, default=0)
+
+    # Copy of the user's record, kept in ranking order by ix_fighter_stats_ranking for the leaderboard
+    wins = Column(Integer, default=0)
+    total_fights = Column(Integer, default=0)
+    win_rate = Column(Float, default=0)
+
+    __table_args__ = (Index("ix_fighter_stats_ranking", "win_rate", "wins", "user_id"),)
+
+
+class SwipedSet(Base):
+    """Ids a user has swiped on as a sorted int32 array, so discover can exclude them in memory"""
+    __tablename__ = "swiped_sets"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    target_ids = Column(LargeBinary, nullable=False, default=b"")
+    size = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 # Pydantic models
 class UserBase(BaseModel):
     username: str
@@ -271,11 +486,19 @@ class UserResponse(UserBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class DiscoverUserResponse(UserResponse):
+    compatibility_score: Optional[float] = None
+
+
 class SwipeRequest(BaseModel):
     target_user_id: int
     is_like: bool
 
 
+class SwipeBatchRequest(BaseModel):
+    swipes: List[SwipeRequest]
+
+
 class FightSchedule(BaseModel):
     opponent_id: int
     scheduled_date: datetime
@@ -289,6 +512,8 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    user_id: Optional[int] = None
+    expires_at: Optional[datetime] = None
 
 
 class UserTitle(Base):
@@ -316,6 +541,8 @@ class UserBadge(Base):
 
     user = relationship("User", back_populates="badges")  # Changed from backref
 
+    __table_args__ = (Index("ix_user_badges_user_badge", "user_id", "badge_id"),)
+
 
 class AchievementNotification(Base):
     __tablename__ = "achievement_notifications"
@@ -332,6 +559,10 @@ class AchievementNotification(Base):
 
     user = relationship("User", back_populates="achievement_notifications")  # Changed from backref
 
+    __table_args__ = (
+        Index("ix_achievement_notifications_user_read_created", "user_id", "is_read", "created_at"),
+    )
+
 
 # Pydantic models
 class TitleResponse(BaseModel):
@@ -369,9 +600,32 @@ class AchievementNotificationResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class FirestoreOutbox(Base):
+    """Firestore writes waiting to be flushed by the sync dispatcher"""
+    __tablename__ = "firestore_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    collection = Column(String)
+    document_id = Column(String)
+    data = Column(JSON)
+    merge = Column(Boolean, default=True)  # False replaces the whole document
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    last_error = Column(Text, nullable=True)
+    # Lease held by the worker currently sending the row
+    claimed_by = Column(String, nullable=True)
+    claimed_until = Column(DateTime, nullable=True)
+    # Set once FIRESTORE_MAX_ATTEMPTS is used up; the row is kept for inspection and no longer sent
+    dead_lettered_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index("ix_firestore_outbox_document", "collection", "document_id"),)
+
+
 # Create tables TODO
 # Base.metadata.drop_all(bind=engine)
-Base.metadata.create_all(bind=engine)
+if not IS_PHOTO_WORKER:
+    Base.metadata.create_all(bind=engine)
 
 
 # Dependency
@@ -403,45 +657,308 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def encode_cursor(values: dict) -> str:
+    """Pack keyset values into an opaque, URL-safe continuation token"""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Unpack a continuation token produced by encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+# Short-lived cache of decoded tokens so hot requests skip JWT verification
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+auth_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL_SECONDS)
+auth_cache_lock = threading.Lock()
+
+
+def decode_token(token: str) -> Optional[TokenData]:
+    """Decode and verify an access token, using the cache when possible"""
+    with auth_cache_lock:
+        token_data = auth_cache.get(token)
+
+    if token_data is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except PyJWTError:
+            return None
+        if payload.get("sub") is None:
+            return None
+
+        token_data = TokenData(
+            username=payload["sub"],
+            user_id=payload.get("uid"),
+            expires_at=datetime.utcfromtimestamp(payload["exp"]) if "exp" in payload else None
+        )
+        with auth_cache_lock:
+            auth_cache[token] = token_data
+
+    # Cached entries must not outlive the token itself
+    if token_data.expires_at and token_data.expires_at <= datetime.utcnow():
+        return None
+
+    return token_data
+
+
+# Ids of recently authenticated users, so get_current_user can skip the users lookup.
+# Only the id is cached: the user it returns loads its other columns from the database
+# on first access, so reads and writes in the request always start from the current row.
+# A user's id never changes, so there is nothing to evict when their profile does.
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+user_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+user_cache_lock = threading.Lock()
+
+
+def cache_user(user: User):
+    with user_cache_lock:
+        user_cache[user.id] = True
+
+
+def load_cached_user(user_id: int, db: Session) -> Optional[User]:
+    """Attach a recently authenticated user to the session without querying, or None on a miss"""
+    with user_cache_lock:
+        if user_id not in user_cache:
+            return None
+
+    # Every column but the id is left unloaded and read from the row when first used
+    user = User(id=user_id)
+    make_transient_to_detached(user)
+    return db.merge(user, load=False)
+
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except PyJWTError:
+    token_data = decode_token(token)
+    if token_data is None:
         raise credentials_exception
-    user = db.query(User).filter(User.username == token_data.username).first()
+
+    if token_data.user_id is not None:
+        user = load_cached_user(token_data.user_id, db)
+        if user is not None:
+            return user
+        # Primary key lookup
+        user = db.get(User, token_data.user_id)
+    else:
+        # Tokens issued before the uid claim was added
+        user = db.query(User).filter(User.username == token_data.username).first()
+
     if user is None:
         raise credentials_exception
+    cache_user(user)
     return user
 
 
+# Server-Sent Events push channel
+EVENTS_HEARTBEAT_SECONDS = 15
+EVENTS_QUEUE_SIZE = 100
+
+
+class EventBroker:
+    """
+    In-process pub/sub for pushing events to connected clients.
+    Each open stream gets its own asyncio queue; publish() can be called from any
+    thread (routes run on the worker pool, achievements on their own thread).
+    With several worker processes each only sees its own subscribers, so a shared
+    broker would have to replace this one.
+    """
+
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(list)  # user_id -> [(loop, queue)]
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        """Register a stream for a user; must be called from the event loop"""
+        stream = asyncio.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers[user_id].append((asyncio.get_running_loop(), stream))
+        return stream
+
+    def unsubscribe(self, user_id: int, stream: asyncio.Queue):
+        with self.lock:
+            self.subscribers[user_id] = [s for s in self.subscribers[user_id] if s[1] is not stream]
+            if not self.subscribers[user_id]:
+                del self.subscribers[user_id]
+
+    def publish(self, user_id: int, event: str, data: dict):
+        """Send an event to every open stream of a user; a no-op when they aren't connected"""
+        with self.lock:
+            streams = list(self.subscribers.get(user_id, []))
+
+        message = f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        for loop, stream in streams:
+            try:
+                loop.call_soon_threadsafe(self._deliver, stream, message)
+            except RuntimeError:
+                # Loop already closed, the stream is going away
+                pass
+
+    @staticmethod
+    def _deliver(stream: asyncio.Queue, message: str):
+        # A client that stopped reading loses its oldest events rather than blocking publishers
+        if stream.full():
+            stream.get_nowait()
+        stream.put_nowait(message)
+
+
+event_broker = EventBroker()
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+
+def resolve_event_user_id(token: Optional[str]) -> int:
+    db = SessionLocal()
+    try:
+        return get_current_user(token or "", db).id
+    finally:
+        db.close()
+
+
+@app.get("/events")
+async def stream_events(
+        request: Request,
+        token: Optional[str] = None,
+        header_token: Optional[str] = Depends(optional_oauth2_scheme)
+):
+    """
+    Server-Sent Events stream of the current user's new matches ("match"),
+    messages ("message") and achievement unlocks ("achievement").
+    EventSource can't send headers, so the access token may be passed as ?token=.
+    """
+    user_id = await run_in_threadpool(resolve_event_user_id, token or header_token)
+
+    async def event_stream():
+        stream = event_broker.subscribe(user_id)
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    yield await asyncio.wait_for(stream.get(), timeout=EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": ping\n\n"
+        finally:
+            event_broker.unsubscribe(user_id, stream)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 import math
 
+EARTH_RADIUS_KM = 6371
+
+# Fixed lat/lon grid used as a spatial index on users.geo_cell
+GEO_CELL_DEGREES = 0.5
+GEO_CELLS_PER_ROW = int(360 / GEO_CELL_DEGREES)
+GEO_MAX_CELLS = 400  # Wider searches skip the cell list and use the bounding box alone
+
+
+def haversine_distances(lat: float, lon: float, lats, lons) -> np.ndarray:
+    """
+    Vectorized Haversine: distances in km from (lat, lon) to every point in lats/lons.
+    Missing coordinates (None/NaN) come back as NaN.
+    """
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lons = np.radians(np.asarray(lons, dtype=float))
+    lat_rad = math.radians(lat)
+
+    a = np.sin((lats - lat_rad) / 2) ** 2 + \
+        math.cos(lat_rad) * np.cos(lats) * np.sin((lons - math.radians(lon)) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _geo_row(lat: float) -> int:
+    return int((min(max(lat, -90.0), 89.999999) + 90) // GEO_CELL_DEGREES)
+
+
+def _geo_col(lon: float) -> int:
+    return int(((lon + 180) % 360) // GEO_CELL_DEGREES)
+
+
+def geo_cell_for(lat, lon):
+    """Grid cell id for a coordinate, or None when the location is unknown"""
+    if lat is None or lon is None:
+        return None
+    return _geo_row(lat) * GEO_CELLS_PER_ROW + _geo_col(lon)
+
+
+def geo_bounding_box(lat: float, lon: float, radius_km: float):
+    """
+    Smallest lat/lon box containing every point within radius_km of (lat, lon).
+    Returns (min_lat, max_lat, lon_ranges); lon_ranges is split in two when the
+    box crosses the antimeridian.
+    """
+    angular = radius_km / EARTH_RADIUS_KM
+    delta_lat = math.degrees(angular)
+    min_lat = lat - delta_lat
+    max_lat = lat + delta_lat
+
+    # Box reaches a pole: every longitude is in range
+    if min_lat <= -90 or max_lat >= 90 or angular >= math.pi / 2:
+        return max(min_lat, -90.0), min(max_lat, 90.0), [(-180.0, 180.0)]
+
+    delta_lon = math.degrees(math.asin(math.sin(angular) / math.cos(math.radians(lat))))
+    min_lon = lon - delta_lon
+    max_lon = lon + delta_lon
+
+    if min_lon < -180:
+        lon_ranges = [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    elif max_lon > 180:
+        lon_ranges = [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    else:
+        lon_ranges = [(min_lon, max_lon)]
+
+    return min_lat, max_lat, lon_ranges
+
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two points using Haversine formula (in km)"""
-    if not all([lat1, lon1, lat2, lon2]):
+def geo_cells_covering(min_lat: float, max_lat: float, lon_ranges):
+    """Grid cells overlapping a bounding box, or None if there are too many to list"""
+    rows = range(_geo_row(min_lat), _geo_row(max_lat) + 1)
+    cols = set()
+    for min_lon, max_lon in lon_ranges:
+        first, last = _geo_col(min_lon), _geo_col(min(max_lon, 179.999999))
+        cols.update(range(first, last + 1))
+
+    if len(rows) * len(cols) > GEO_MAX_CELLS:
         return None
+    return [row * GEO_CELLS_PER_ROW + col for row in rows for col in cols]
+
 
-    R = 6371  # Earth's radius in kilometers
+def geo_radius_prefilter(lat: float, lon: float, radius_km: float):
+    """
+    SQL predicate pruning users to the bounding box around (lat, lon).
+    Uses the indexed geo_cell column when the box covers few enough cells;
+    exact distances still have to be checked on the rows it returns.
+    """
+    min_lat, max_lat, lon_ranges = geo_bounding_box(lat, lon, radius_km)
 
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    delta_lat = math.radians(lat2 - lat1)
-    delta_lon = math.radians(lon2 - lon1)
+    conditions = [
+        User.latitude.between(min_lat, max_lat),
+        or_(*[User.longitude.between(min_lon, max_lon) for min_lon, max_lon in lon_ranges]),
+    ]
 
-    a = math.sin(delta_lat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon / 2) ** 2
-    c = 2 * math.asin(math.sqrt(a))
+    cells = geo_cells_covering(min_lat, max_lat, lon_ranges)
+    if cells is not None:
+        conditions.insert(0, User.geo_cell.in_(cells))
 
-    return R * c
+    return and_(*conditions)
 
 
 ACHIEVEMENTS_CONFIG = {
@@ -453,6 +970,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Beginner",
         "points": 10,
         "badge_id": "first_match_badge",
+        "depends_on": ["total_fights"],
         "check": lambda stats: stats["total_fights"] >= 1
     },
     "first_win": {
@@ -462,6 +980,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Beginner",
         "points": 15,
         "badge_id": "first_win_badge",
+        "depends_on": ["wins"],
         "check": lambda stats: stats["wins"] >= 1
     },
     "dedicated": {
@@ -471,6 +990,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Beginner",
         "points": 20,
         "badge_id": "dedicated_badge",
+        "depends_on": ["training_streak"],
         "check": lambda stats: stats["training_streak"] >= 7
     },
 
@@ -482,6 +1002,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Intermediate",
         "points": 30,
         "badge_id": "warrior_badge",
+        "depends_on": ["total_fights"],
         "check": lambda stats: stats["total_fights"] >= 25
     },
     "hot_streak": {
@@ -491,6 +1012,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Intermediate",
         "points": 25,
         "badge_id": "hot_streak_badge",
+        "depends_on": ["current_streak"],
         "check": lambda stats: stats["current_streak"] >= 5
     },
     "style_master": {
@@ -500,6 +1022,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Intermediate",
         "points": 35,
         "badge_id": "style_master_badge",
+        "depends_on": ["styles_trained"],
         "check": lambda stats: stats["styles_trained"] >= 5
     },
     "social_butterfly": {
@@ -509,6 +1032,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Intermediate",
         "points": 20,
         "badge_id": "social_badge",
+        "depends_on": ["total_matches"],
         "check": lambda stats: stats.get("total_matches", 0) >= 10
     },
 
@@ -520,6 +1044,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Advanced",
         "points": 50,
         "badge_id": "centurion_badge",
+        "depends_on": ["total_fights"],
         "check": lambda stats: stats["total_fights"] >= 100
     },
     "unstoppable": {
@@ -529,6 +1054,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Advanced",
         "points": 40,
         "badge_id": "unstoppable_badge",
+        "depends_on": ["longest_streak"],
         "check": lambda stats: stats["longest_streak"] >= 10
     },
     "champion": {
@@ -538,6 +1064,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Advanced",
         "points": 60,
         "badge_id": "champion_badge",
+        "depends_on": ["win_rate", "total_fights"],
         "check": lambda stats: stats["win_rate"] >= 80 and stats["total_fights"] >= 50
     },
     "knockout_artist": {
@@ -547,6 +1074,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Advanced",
         "points": 35,
         "badge_id": "knockout_badge",
+        "depends_on": ["wins"],
         "check": lambda stats: stats["wins"] >= 20
     },
 
@@ -558,6 +1086,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Elite",
         "points": 100,
         "badge_id": "legend_badge",
+        "depends_on": ["total_fights"],
         "check": lambda stats: stats["total_fights"] >= 500
     },
     "grand_master": {
@@ -567,6 +1096,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Elite",
         "points": 75,
         "badge_id": "grand_master_badge",
+        "depends_on": ["styles_trained"],
         "check": lambda stats: stats["styles_trained"] >= 10
     },
     "immortal": {
@@ -576,6 +1106,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Elite",
         "points": 150,
         "badge_id": "immortal_badge",
+        "depends_on": ["longest_streak"],
         "check": lambda stats: stats["longest_streak"] >= 25
     },
     "iron_wall": {
@@ -585,6 +1116,7 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Elite",
         "points": 100,
         "badge_id": "iron_wall_badge",
+        "depends_on": ["training_streak"],
         "check": lambda stats: stats["training_streak"] >= 30
     },
     "sensei": {
@@ -594,10 +1126,24 @@ ACHIEVEMENTS_CONFIG = {
         "category": "Elite",
         "points": 50,
         "badge_id": "sensei_badge",
+        "depends_on": ["total_matches"],
         "check": lambda stats: stats.get("total_matches", 0) >= 50
     },
 }
 
+# Achievement rules indexed by the stat they depend on
+ACHIEVEMENT_RULES_BY_STAT = defaultdict(list)
+for _achievement_id, _achievement in ACHIEVEMENTS_CONFIG.items():
+    for _stat in _achievement["depends_on"]:
+        ACHIEVEMENT_RULES_BY_STAT[_stat].append(_achievement_id)
+
+# Stats that can change for each event that triggers an achievement check
+ACHIEVEMENT_EVENT_STATS = {
+    "fight_recorded": ["total_fights", "wins", "win_rate", "current_streak", "longest_streak", "training_streak"],
+    "match_created": ["total_matches"],
+    "profile_updated": ["styles_trained"],
+}
+
 # Title ranks based on total points
 TITLES_CONFIG = {
     "novice": {
@@ -653,12 +1199,25 @@ TITLES_CONFIG = {
 
 
 # Helper function to check achievements and award badges
-def check_and_award_achievements(user_id: int, db: Session):
-    """Check user stats and award new achievements"""
+def check_and_award_achievements(user_id: int, db: Session, event: Optional[str] = None):
+    """
+    Check user stats and award new achievements.
+    With an event (see ACHIEVEMENT_EVENT_STATS) only the rules depending on
+    stats that event can change are evaluated; without one, every rule is.
+    """
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         return []
 
+    if event is None:
+        candidate_ids = list(ACHIEVEMENTS_CONFIG.keys())
+    else:
+        candidate_ids = list(dict.fromkeys(
+            achievement_id
+            for stat in ACHIEVEMENT_EVENT_STATS[event]
+            for achievement_id in ACHIEVEMENT_RULES_BY_STAT[stat]
+        ))
+
     # Get user stats
     stats = get_user_stats_dict(user_id, db)
 
@@ -670,8 +1229,9 @@ def check_and_award_achievements(user_id: int, db: Session):
 
     newly_unlocked = []
 
-    # Check each achievement
-    for achievement_id, achievement in ACHIEVEMENTS_CONFIG.items():
+    # Check each affected achievement
+    for achievement_id in candidate_ids:
+        achievement = ACHIEVEMENTS_CONFIG[achievement_id]
         badge_id = achievement.get("badge_id")
 
         # Skip if already unlocked
@@ -685,6 +1245,8 @@ def check_and_award_achievements(user_id: int, db: Session):
                 new_badge = UserBadge(
                     user_id=user_id,
                     badge_id=badge_id,
+                    badge_name=achievement["name"],
+                    badge_icon=achievement["icon"],
                     is_displayed=len(unlocked_badge_ids) < 3  # Auto-display first 3 badges
                 )
                 db.add(new_badge)
@@ -692,9 +1254,10 @@ def check_and_award_achievements(user_id: int, db: Session):
                 # Create notification
                 notification = AchievementNotification(
                     user_id=user_id,
+                    achievement_type="badge",
                     achievement_id=achievement_id,
                     title=f"🎉 {achievement['name']} Unlocked!",
-                    message=achievement['description'],
+                    description=achievement['description'],
                     points_earned=achievement['points']
                 )
                 db.add(notification)
@@ -712,7 +1275,8 @@ def check_and_award_achievements(user_id: int, db: Session):
 
     # Check and update title
     total_points = sum(a["points"] for a in ACHIEVEMENTS_CONFIG.values()
-                       if ACHIEVEMENTS_CONFIG[a]["badge_id"] in unlocked_badge_ids)
+                       if a["badge_id"] in unlocked_badge_ids)
+    user.total_achievement_points = total_points
 
     current_title = get_title_for_points(total_points)
     if user.current_title != current_title:
@@ -722,17 +1286,59 @@ def check_and_award_achievements(user_id: int, db: Session):
         title_info = TITLES_CONFIG[current_title]
         notification = AchievementNotification(
             user_id=user_id,
+            achievement_type="title",
             achievement_id=f"title_{current_title}",
             title=f"🎖️ New Title: {title_info['name']}!",
-            message=title_info['description'],
+            description=title_info['description'],
             points_earned=0
         )
         db.add(notification)
 
     db.commit()
+
+    for unlocked in newly_unlocked:
+        event_broker.publish(user_id, "achievement", unlocked)
+
     return newly_unlocked
 
 
+# Background achievement evaluation, keeps rule checks off the request path
+ACHIEVEMENTS_ASYNC = os.getenv("ACHIEVEMENTS_ASYNC", "true").lower() == "true"
+achievement_queue = queue.Queue()
+
+
+def trigger_achievement_check(user_id: int, event: str, db: Session) -> list:
+    """
+    Run the achievement check for an event: queued for the background worker when
+    ACHIEVEMENTS_ASYNC is on (returns []), inline otherwise (returns new unlocks)
+    """
+    if ACHIEVEMENTS_ASYNC:
+        achievement_queue.put((user_id, event))
+        return []
+    return check_and_award_achievements(user_id, db, event=event)
+
+
+def run_achievement_worker():
+    """Evaluate queued achievement checks, each in its own session"""
+    while True:
+        user_id, event = achievement_queue.get()
+        db = SessionLocal()
+        try:
+            check_and_award_achievements(user_id, db, event=event)
+        except Exception as e:
+            db.rollback()
+            print(f"Error evaluating achievements for user {user_id}: {e}")
+        finally:
+            db.close()
+            achievement_queue.task_done()
+
+
+@app.on_event("startup")
+def start_achievement_worker():
+    if ACHIEVEMENTS_ASYNC:
+        threading.Thread(target=run_achievement_worker, name="achievement-worker", daemon=True).start()
+
+
 def get_title_for_points(points: int) -> str:
     """Get appropriate title based on total points"""
     for title_id in reversed(list(TITLES_CONFIG.keys())):
@@ -741,65 +1347,106 @@ def get_title_for_points(points: int) -> str:
     return "novice"
 
 
-def get_user_stats_dict(user_id: int, db: Session) -> dict:
-    """Get all user stats needed for achievement checking"""
-    user = db.query(User).filter(User.id == user_id).first()
+def apply_fight_to_stats(stats: FighterStats, won: bool, fight_date: datetime):
+    """Fold one more fight (newer than any already counted) into a user's stats row"""
+    if won:
+        stats.current_streak = (stats.current_streak or 0) + 1
+        stats.longest_streak = max(stats.longest_streak or 0, stats.current_streak)
+    else:
+        stats.current_streak = 0
 
-    # Get martial arts count
-    if isinstance(user.martial_arts, list):
-        martial_arts = user.martial_arts
-    elif isinstance(user.martial_arts, str):
-        try:
-            martial_arts = json.loads(user.martial_arts)
-        except:
-            martial_arts = []
+    day = fight_date.date()
+    if stats.last_training_date == day:
+        return
+    if stats.last_training_date == day - timedelta(days=1):
+        stats.training_streak = (stats.training_streak or 0) + 1
     else:
-        martial_arts = []
+        stats.training_streak = 1
+    stats.last_training_date = day
+    stats.unique_training_days = (stats.unique_training_days or 0) + 1
+
+
+def sync_record_to_stats(stats: FighterStats, user: User):
+    """Copy a user's win/loss/draw record onto their stats row"""
+    total_fights = (user.wins or 0) + (user.losses or 0) + (user.draws or 0)
+    stats.wins = user.wins or 0
+    stats.total_fights = total_fights
+    stats.win_rate = (stats.wins / total_fights * 100) if total_fights > 0 else 0
+
 
-    # Calculate streaks
+def rebuild_fighter_stats(user_id: int, db: Session) -> FighterStats:
+    """Recompute a user's stats row from their full fight history"""
     fights = db.query(FightRecord).filter(
-        (FightRecord.user_id == user.id) | (FightRecord.opponent_id == user.id)
-    ).order_by(FightRecord.date.desc()).all()
+        (FightRecord.user_id == user_id) | (FightRecord.opponent_id == user_id)
+    ).order_by(FightRecord.date.asc()).all()
 
-    current_streak = 0
-    longest_streak = 0
-    temp_streak = 0
+    stats = db.get(FighterStats, user_id) or FighterStats(user_id=user_id)
+    stats.current_streak = 0
+    stats.longest_streak = 0
+    stats.training_streak = 0
+    stats.last_training_date = None
+    stats.unique_training_days = 0
 
     for fight in fights:
-        is_winner = (fight.user_id == user.id and fight.result == "win") or \
-                    (fight.opponent_id == user.id and fight.result == "loss")
+        is_winner = (fight.user_id == user_id and fight.result == "win") or \
+                    (fight.opponent_id == user_id and fight.result == "loss")
+        apply_fight_to_stats(stats, is_winner, fight.date)
 
-        if is_winner:
-            temp_streak += 1
-            longest_streak = max(longest_streak, temp_streak)
-        else:
-            temp_streak = 0
+    user = db.get(User, user_id)
+    if user:
+        sync_record_to_stats(stats, user)
 
-    # Current streak
-    for fight in fights:
-        is_winner = (fight.user_id == user.id and fight.result == "win") or \
-                    (fight.opponent_id == user.id and fight.result == "loss")
-        if is_winner:
-            current_streak += 1
-        else:
-            break
+    db.add(stats)
+    return stats
 
-    # Training streak
-    training_days = set()
-    for fight in fights:
-        training_days.add(fight.date.date())
 
-    training_streak = 0
-    check_date = datetime.utcnow().date()
-    while check_date in training_days:
-        training_streak += 1
-        check_date -= timedelta(days=1)
+def get_fighter_stats(user_id: int, db: Session) -> FighterStats:
+    """Get a user's stats row, building it from history the first time it's needed"""
+    stats = db.get(FighterStats, user_id)
+    if stats is None:
+        stats = rebuild_fighter_stats(user_id, db)
+        db.commit()
+    return stats
+
+
+def get_streaks(stats: FighterStats) -> dict:
+    """Streak values as of today from a stats row"""
+    # The training streak only counts if it runs up to today
+    training_streak = stats.training_streak if stats.last_training_date == datetime.utcnow().date() else 0
+
+    return {
+        "current_streak": stats.current_streak,
+        "longest_streak": stats.longest_streak,
+        "training_streak": training_streak
+    }
+
+
+def get_martial_arts_list(user: User) -> list:
+    """martial_arts as a list, handling legacy JSON-string values"""
+    if isinstance(user.martial_arts, list):
+        return user.martial_arts
+    if isinstance(user.martial_arts, str):
+        try:
+            return json.loads(user.martial_arts)
+        except ValueError:
+            return []
+    return []
+
+
+def get_user_stats_dict(user_id: int, db: Session) -> dict:
+    """Get all user stats needed for achievement checking"""
+    user = db.query(User).filter(User.id == user_id).first()
+
+    martial_arts = get_martial_arts_list(user)
+    streaks = get_streaks(get_fighter_stats(user_id, db))
 
     total_fights = user.wins + user.losses + user.draws
     win_rate = (user.wins / total_fights * 100) if total_fights > 0 else 0
 
     # Get match count
-    total_matches = len(user.matches)
+    total_matches = db.query(func.count()).select_from(matches_table).filter(
+        matches_table.c.user_id == user_id
+    ).scalar()
 
     return {
         "total_fights": total_fights,
@@ -807,10 +1454,10 @@ def get_user_stats_dict(user_id: int, db: Session) -> dict:
         "losses": user.losses,
         "draws": user.draws,
         "win_rate": win_rate,
-        "current_streak": current_streak,
-        "longest_streak": longest_streak,
+        "current_streak": streaks["current_streak"],
+        "longest_streak": streaks["longest_streak"],
         "styles_trained": len(martial_arts),
-        "training_streak": training_streak,
+        "training_streak": streaks["training_streak"],
         "total_matches": total_matches
     }
 
@@ -1038,18 +1685,31 @@ def record_fight(
     if fight_data.result not in ["win", "loss", "draw"]:
         raise HTTPException(status_code=400, detail="Invalid result")
 
+    # Load streak rows before adding the fight so a first-time rebuild doesn't count it
+    user_stats = get_fighter_stats(current_user.id, db)
+    opponent_stats = None
+    if fight_data.opponent_id != current_user.id and db.get(User, fight_data.opponent_id):
+        opponent_stats = get_fighter_stats(fight_data.opponent_id, db)
+
     # Create fight record
+    fight_date = datetime.utcnow()
     fight_record = FightRecord(
         user_id=current_user.id,
         opponent_id=fight_data.opponent_id,
         result=fight_data.result,
         martial_art_style=fight_data.martial_art_style,
+        date=fight_date,
         notes=fight_data.notes if fight_data.notes else None
     )
     db.add(fight_record)
 
-    # Update user stats
-    user = db.query(User).filter(User.id == current_user.id).first()
+    # Update streaks
+    apply_fight_to_stats(user_stats, fight_data.result == "win", fight_date)
+    if opponent_stats:
+        apply_fight_to_stats(opponent_stats, fight_data.result == "loss", fight_date)
+
+    # Update user stats on rows locked for this transaction, so concurrent fights can't lose an increment
+    user = select_for_update(db.query(User).filter(User.id == current_user.id)).first()
     if fight_data.result == "win":
         user.wins += 1
     elif fight_data.result == "loss":
@@ -1058,7 +1718,7 @@ def record_fight(
         user.draws += 1
 
     # Update opponent stats
-    opponent = db.query(User).filter(User.id == fight_data.opponent_id).first()
+    opponent = select_for_update(db.query(User).filter(User.id == fight_data.opponent_id)).first()
     if opponent:
         if fight_data.result == "win":
             opponent.losses += 1
@@ -1067,10 +1727,16 @@ def record_fight(
         else:
             opponent.draws += 1
 
+    sync_record_to_stats(user_stats, user)
+    if opponent_stats:
+        sync_record_to_stats(opponent_stats, opponent)
+
     db.commit()
 
     # Check for new achievements
-    newly_unlocked = check_and_award_achievements(current_user.id, db)
+    newly_unlocked = trigger_achievement_check(current_user.id, "fight_recorded", db)
+    if opponent:
+        trigger_achievement_check(opponent.id, "fight_recorded", db)
 
     return {
         "message": "Fight recorded successfully",
@@ -1080,14 +1746,252 @@ def record_fight(
             "losses": user.losses,
             "draws": user.draws
         },
-        "newly_unlocked": newly_unlocked
+        "newly_unlocked": newly_unlocked,
+        "achievements_pending": ACHIEVEMENTS_ASYNC
+    }
+
+
+# Write-behind Firestore sync: writes are stored in firestore_outbox in the same
+# transaction as the SQL change and flushed to Firestore by a background dispatcher
+FIRESTORE_BATCH_LIMIT = 500  # Max operations in one Firestore batched write
+FIRESTORE_SYNC_INTERVAL_SECONDS = float(os.getenv("FIRESTORE_SYNC_INTERVAL_SECONDS", "2"))
+FIRESTORE_RETRY_MAX_SECONDS = 300
+FIRESTORE_MAX_ATTEMPTS = int(os.getenv("FIRESTORE_MAX_ATTEMPTS", "8"))
+FIRESTORE_CLAIM_SECONDS = 60  # Lease on claimed rows; a crashed worker's rows are picked up after it
+SERVER_TIMESTAMP_PLACEHOLDER = "__server_timestamp__"
+firestore_outbox_wakeup = threading.Event()
+
+
+def queue_firestore_write(db: Session, collection: str, document_id, data: dict, merge: bool = True):
+    """
+    Add a Firestore document write to the outbox; it is sent once the caller commits.
+    merge=True updates the given fields, merge=False replaces the document.
+    """
+    stored = {
+        key: SERVER_TIMESTAMP_PLACEHOLDER if value is firestore.SERVER_TIMESTAMP
+        else value.isoformat() if isinstance(value, datetime)
+        else value
+        for key, value in data.items()
+    }
+    db.add(FirestoreOutbox(collection=collection, document_id=str(document_id), data=stored, merge=merge))
+    db.info["firestore_outbox_queued"] = True
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def wake_firestore_sync_worker(session):
+    # Only after commit, so the worker can see the rows
+    if session.info.pop("firestore_outbox_queued", False):
+        firestore_outbox_wakeup.set()
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def forget_queued_firestore_writes(session):
+    session.info.pop("firestore_outbox_queued", None)
+
+
+def coalesce_outbox_rows(rows: list) -> tuple:
+    """Fold a document's pending writes (oldest first) into one (data, merge) write"""
+    data = {}
+    merge = True
+    for row in rows:
+        if not row.merge:
+            data = {}
+            merge = False
+        data.update(row.data or {})
+
+    data = {
+        key: firestore.SERVER_TIMESTAMP if value == SERVER_TIMESTAMP_PLACEHOLDER else value
+        for key, value in data.items()
     }
+    return data, merge
+
+
+def claim_outbox_documents(db: Session, worker_id: str) -> dict:
+    """
+    Lease the pending rows of up to FIRESTORE_BATCH_LIMIT due documents for this worker.
+    A document is only ever held by one worker, so its writes can't be sent out of order.
+    Returns {(collection, document_id): rows, oldest first}.
+    """
+    now = datetime.utcnow()
+    pending = FirestoreOutbox.dead_lettered_at.is_(None)
+    claimed = and_(FirestoreOutbox.claimed_until.isnot(None), FirestoreOutbox.claimed_until > now)
+
+    # A document is due once all of its pending writes are, so a write in
+    # backoff is never overtaken by a newer one for the same document
+    due_documents = db.query(FirestoreOutbox.collection, FirestoreOutbox.document_id).filter(
+        pending
+    ).group_by(
+        FirestoreOutbox.collection, FirestoreOutbox.document_id
+    ).having(and_(
+        func.max(FirestoreOutbox.next_attempt_at) <= now,
+        func.sum(case((claimed, 1), else_=0)) == 0
+    )).order_by(func.min(FirestoreOutbox.id)).limit(FIRESTORE_BATCH_LIMIT).all()
+
+    if not due_documents:
+        return {}
+
+    in_due_documents = tuple_(FirestoreOutbox.collection, FirestoreOutbox.document_id).in_(
+        [tuple(document) for document in due_documents]
+    )
+    db.query(FirestoreOutbox).filter(in_due_documents, pending, ~claimed).update({
+        "claimed_by": worker_id,
+        "claimed_until": now + timedelta(seconds=FIRESTORE_CLAIM_SECONDS)
+    }, synchronize_session=False)
+    db.commit()
+
+    # Another worker can claim rows of the same document at the same moment; both back off from it
+    now = datetime.utcnow()
+    contested = db.query(FirestoreOutbox.collection, FirestoreOutbox.document_id).filter(
+        in_due_documents, pending,
+        FirestoreOutbox.claimed_by != worker_id,
+        FirestoreOutbox.claimed_until > now
+    ).distinct().all()
+    if contested:
+        db.query(FirestoreOutbox).filter(
+            tuple_(FirestoreOutbox.collection, FirestoreOutbox.document_id).in_(
+                [tuple(document) for document in contested]
+            ),
+            FirestoreOutbox.claimed_by == worker_id
+        ).update({"claimed_by": None, "claimed_until": None}, synchronize_session=False)
+        db.commit()
+
+    rows = db.query(FirestoreOutbox).filter(
+        FirestoreOutbox.claimed_by == worker_id, pending
+    ).order_by(FirestoreOutbox.id).all()
+
+    rows_by_document = defaultdict(list)
+    for row in rows:
+        rows_by_document[(row.collection, row.document_id)].append(row)
+    return rows_by_document
+
+
+def write_outbox_documents(rows_by_document: dict) -> dict:
+    """
+    Send documents to Firestore in one batch. If the batch fails, each document is
+    retried on its own so one bad write doesn't hold back the rest.
+    Returns {(collection, document_id): error} for the documents that failed.
+    """
+    def write(documents):
+        batch = firebase_db.batch()
+        for (collection, document_id), document_rows in documents:
+            data, merge = coalesce_outbox_rows(document_rows)
+            batch.set(firebase_db.collection(collection).document(document_id), data, merge=merge)
+        batch.commit()
+
+    try:
+        write(rows_by_document.items())
+        return {}
+    except Exception as e:
+        if len(rows_by_document) == 1:
+            return {document: str(e) for document in rows_by_document}
+
+    failed = {}
+    for document, document_rows in rows_by_document.items():
+        try:
+            write([(document, document_rows)])
+        except Exception as e:
+            failed[document] = str(e)
+    return failed
+
+
+def flush_firestore_outbox(db: Session) -> int:
+    """
+    Send one batch of due documents to Firestore. Returns the number of documents
+    written, 0 when nothing was due or every document failed and was rescheduled.
+    """
+    worker_id = f"{os.getpid()}-{uuid.uuid4().hex}"
+    rows_by_document = claim_outbox_documents(db, worker_id)
+    if not rows_by_document:
+        return 0
+
+    failed = write_outbox_documents(rows_by_document)
+
+    now = datetime.utcnow()
+    for document, error in failed.items():
+        print(f"Error writing {document[0]}/{document[1]} to Firebase: {error}")
+        for row in rows_by_document[document]:
+            row.attempts = (row.attempts or 0) + 1
+            row.last_error = error
+            row.claimed_by = None
+            row.claimed_until = None
+            if row.attempts >= FIRESTORE_MAX_ATTEMPTS:
+                row.dead_lettered_at = now
+            else:
+                row.next_attempt_at = now + timedelta(seconds=min(2 ** row.attempts, FIRESTORE_RETRY_MAX_SECONDS))
+
+    written_ids = [
+        row.id
+        for document, document_rows in rows_by_document.items() if document not in failed
+        for row in document_rows
+    ]
+    if written_ids:
+        # Only rows this worker still holds, so an expired lease can't delete someone else's claim
+        db.query(FirestoreOutbox).filter(
+            FirestoreOutbox.id.in_(written_ids),
+            FirestoreOutbox.claimed_by == worker_id
+        ).delete(synchronize_session=False)
+    db.commit()
+    return len(rows_by_document) - len(failed)
+
+
+def run_firestore_sync_worker():
+    """Flush the outbox whenever writes are queued, and periodically for retries"""
+    while True:
+        firestore_outbox_wakeup.wait(FIRESTORE_SYNC_INTERVAL_SECONDS)
+        firestore_outbox_wakeup.clear()
+
+        db = SessionLocal()
+        try:
+            while flush_firestore_outbox(db):
+                pass
+        except Exception as e:
+            db.rollback()
+            print(f"Error in Firebase sync worker: {e}")
+        finally:
+            db.close()
+
+
+@app.on_event("startup")
+def start_firestore_sync_worker():
+    threading.Thread(target=run_firestore_sync_worker, name="firestore-sync", daemon=True).start()
+
+
 # Routes
 @app.get("/")
 def read_root():
     return {"message": "Welcome to Fight Match API! Access documentation at /docs"}
 
 
+@app.get("/metrics/db")
+async def database_metrics():
+    """Connection pool utilisation for this worker process, for tuning pool and thread pool sizes"""
+    pool = engine.pool
+    metrics = {
+        "dialect": engine.dialect.name,
+        "pool": type(pool).__name__,
+        "threadpool_size": THREADPOOL_SIZE,
+        "threadpool_in_use": anyio.to_thread.current_default_thread_limiter().borrowed_tokens,
+    }
+    # QueuePool counters; SQLite in-memory databases use a pool without them
+    if hasattr(pool, "checkedout"):
+        metrics.update({
+            "pool_size": pool.size(),
+            "max_overflow": DB_MAX_OVERFLOW,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "timeout_seconds": pool.timeout(),
+        })
+    if engine.dialect.name == "sqlite":
+        metrics["sqlite_writer"] = {
+            "locked": sqlite_write_lock.locked(),
+            "acquired": sqlite_write_stats["acquired"],
+            "timeouts": sqlite_write_stats["timeouts"],
+            "total_wait_seconds": round(sqlite_write_stats["wait_seconds"], 3),
+        }
+    return metrics
+
+
 @app.post("/register", response_model=UserResponse)
 def register(user: UserCreate, db: Session = Depends(get_db)):
     db_user = db.query(User).filter(
@@ -1113,42 +2017,41 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         preferred_styles=user.preferred_styles,
         weight_class=user.weight_class
     )
+    sync_discover_search_rows(db_user)
     db.add(db_user)
+    db.flush()
+
+    # Sync to Firebase Firestore (sent by the outbox dispatcher after commit)
+    queue_firestore_write(db, 'users', db_user.id, {
+        'id': db_user.id,
+        'username': db_user.username,
+        'email': db_user.email,
+        'full_name': db_user.full_name,
+        'age': db_user.age,
+        'height': db_user.height,
+        'weight': db_user.weight,
+        'location': db_user.location,
+        'bio': db_user.bio,
+        'martial_arts': db_user.martial_arts,
+        'experience_years': db_user.experience_years,
+        'skill_level': db_user.skill_level,
+        'preferred_styles': db_user.preferred_styles,
+        'weight_class': db_user.weight_class,
+        'wins': db_user.wins,
+        'losses': db_user.losses,
+        'draws': db_user.draws,
+        'profile_pic': db_user.profile_pic,
+        'created_at': firestore.SERVER_TIMESTAMP
+    }, merge=False)
+
     db.commit()
     db.refresh(db_user)
 
-    # ✅ ADD THIS: Sync to Firebase Firestore
-    try:
-        firebase_db.collection('users').document(str(db_user.id)).set({
-            'id': db_user.id,
-            'username': db_user.username,
-            'email': db_user.email,
-            'full_name': db_user.full_name,
-            'age': db_user.age,
-            'height': db_user.height,
-            'weight': db_user.weight,
-            'location': db_user.location,
-            'bio': db_user.bio,
-            'martial_arts': db_user.martial_arts,
-            'experience_years': db_user.experience_years,
-            'skill_level': db_user.skill_level,
-            'preferred_styles': db_user.preferred_styles,
-            'weight_class': db_user.weight_class,
-            'wins': db_user.wins,
-            'losses': db_user.losses,
-            'draws': db_user.draws,
-            'profile_pic': db_user.profile_pic,
-            'created_at': firestore.SERVER_TIMESTAMP
-        })
-    except Exception as e:
-        print(f"Error syncing user to Firebase: {e}")
-        # Don't fail registration if Firebase sync fails
-
     return db_user
 
 
 @app.post("/token", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = db.query(User).filter(User.username == form_data.username).first()
     if not user or not verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
@@ -1158,57 +2061,656 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": user.id}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 @app.get("/users/me")
-async def read_users_me(current_user: User = Depends(get_current_user)):
+def read_users_me(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    # The response is built from the loaded attributes, and a cached user only has its id loaded
+    db.refresh(current_user)
     return current_user
 
 
-@app.get("/users/discover", response_model=List[UserResponse])
-async def discover_users(
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
-):
-    """
-    Get users that haven't been swiped on yet
+DISCOVER_PAGE_SIZE = 20
+DISCOVER_MAX_PAGE_SIZE = 100
+
+
+def pack_user_ids(user_ids) -> bytes:
+    return np.asarray(user_ids, dtype=np.int32).tobytes()
+
+
+def unpack_user_ids(data: bytes) -> np.ndarray:
+    return np.frombuffer(data or b"", dtype=np.int32)
+
+
+def query_swiped_ids(user_id: int, db: Session) -> np.ndarray:
+    """Sorted ids the user has swiped on, read from the swipes table"""
+    return np.unique(np.fromiter(
+        db.execute(select(Swipe.target_user_id).where(Swipe.user_id == user_id)).scalars(),
+        dtype=np.int32
+    ))
+
+
+def rebuild_swiped_set(user_id: int, db: Session) -> SwipedSet:
+    """Recompute a user's swiped set from the swipes table (caller commits)"""
+    target_ids = query_swiped_ids(user_id, db)
+
+    swiped_set = db.get(SwipedSet, user_id)
+    if swiped_set is None:
+        swiped_set = SwipedSet(user_id=user_id)
+        db.add(swiped_set)
+    swiped_set.target_ids = pack_user_ids(target_ids)
+    swiped_set.size = len(target_ids)
+    return swiped_set
+
+
+def create_swiped_set(user_id: int, db: Session):
+    """Build a user's swiped set unless a concurrent request already has (caller commits)"""
+    target_ids = query_swiped_ids(user_id, db)
+    db.execute(insert_ignoring_conflicts(SwipedSet.__table__, [
+        {"user_id": user_id, "target_ids": pack_user_ids(target_ids), "size": len(target_ids)}
+    ], ["user_id"]))
+
+
+def get_swiped_ids(user_id: int, db: Session) -> np.ndarray:
+    """Sorted ids of everyone the user has swiped on, building the set the first time it's needed"""
+    swiped_set = db.get(SwipedSet, user_id)
+    if swiped_set is None:
+        create_swiped_set(user_id, db)
+        db.commit()
+        swiped_set = db.get(SwipedSet, user_id)
+    return unpack_user_ids(swiped_set.target_ids)
+
+
+def add_swiped_ids(user_id: int, target_ids: list, db: Session):
+    """Merge newly recorded swipes into the user's swiped set (caller commits)"""
+    def lock_swiped_set():
+        # FOR UPDATE on Postgres; on SQLite (which ignores it) the session's write lock
+        return select_for_update(db.query(SwipedSet).filter(SwipedSet.user_id == user_id)).first()
+
+    swiped_set = lock_swiped_set()
+    if swiped_set is None:
+        # A set created meanwhile by another request may predate these swipes, so they're merged in regardless
+        create_swiped_set(user_id, db)
+        swiped_set = lock_swiped_set()
+
+    merged = np.union1d(unpack_user_ids(swiped_set.target_ids), np.asarray(target_ids, dtype=np.int32))
+    swiped_set.target_ids = pack_user_ids(merged)
+    swiped_set.size = len(merged)
+
+
+def swiped_mask(candidate_ids: np.ndarray, swiped_ids: np.ndarray) -> np.ndarray:
+    """True for each candidate id found in the sorted swiped ids (binary search)"""
+    if not len(swiped_ids):
+        return np.zeros(len(candidate_ids), dtype=bool)
+    positions = np.minimum(np.searchsorted(swiped_ids, candidate_ids), len(swiped_ids) - 1)
+    return swiped_ids[positions] == candidate_ids
+
+
+# Ids per query when loading candidates by id, well under SQLite's bound parameter limit
+DISCOVER_LOAD_CHUNK_SIZE = 500
+
+
+def load_unswiped_users(query, swiped_ids: np.ndarray) -> list:
+    """Run a discover query for ids only, drop swiped ids, then load the remaining users in chunks"""
+    candidate_ids = np.fromiter(
+        (user_id for (user_id,) in query.with_entities(User.id)), dtype=np.int64
+    )
+    candidate_ids = candidate_ids[~swiped_mask(candidate_ids, swiped_ids)].tolist()
+
+    users = []
+    for i in range(0, len(candidate_ids), DISCOVER_LOAD_CHUNK_SIZE):
+        chunk = candidate_ids[i:i + DISCOVER_LOAD_CHUNK_SIZE]
+        users.extend(query.session.query(User).filter(User.id.in_(chunk)).order_by(User.id).all())
+    return users
+
+
+# Compatibility scoring for ranking discover candidates; each component is in [0, 1]
+WEIGHT_CLASS_ORDER = [
+    "Flyweight", "Bantamweight", "Featherweight", "Lightweight",
+    "Welterweight", "Middleweight", "Light Heavyweight", "Heavyweight"
+]
+SKILL_LEVEL_ORDER = ["Beginner", "Intermediate", "Advanced", "Professional"]
+SKILL_LEVEL_ALIASES = {"pro": "professional"}
+SKILL_RANGE_MAX_GAP = {"same": 0, "similar": 1}  # preferred_skill_range -> allowed level gap, anything else allows all
+COMPATIBILITY_WEIGHTS = {
+    "weight_class": 0.30,
+    "skill_level": 0.20,
+    "styles": 0.25,
+    "distance": 0.15,
+    "skill_range": 0.10,
+}
+UNKNOWN_COMPONENT_SCORE = 0.5  # Missing profile data counts as neutral
+
+
+def style_list(value) -> list:
+    """martial_arts / preferred_styles value as a list, handling legacy JSON-string values"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return []
+    return value if isinstance(value, list) else []
+
+
+def ordinal_positions(values, order: list, aliases: dict = None) -> np.ndarray:
+    """Position of each value in an ordered scale (case-insensitive), NaN when unknown"""
+    index = {name.lower(): position for position, name in enumerate(order)}
+    for alias, name in (aliases or {}).items():
+        index[alias] = index[name]
+    return np.array([index.get(str(value).lower(), np.nan) if value else np.nan for value in values], dtype=float)
+
+
+def scale_proximity(positions: np.ndarray, own_position: float, span: int) -> np.ndarray:
+    """1 at the same position down to 0 at the opposite end of the scale"""
+    scores = 1 - np.abs(positions - own_position) / span
+    return np.where(np.isnan(scores), UNKNOWN_COMPONENT_SCORE, scores)
+
+
+def skill_range_fit(preferred_ranges, gaps: np.ndarray) -> np.ndarray:
     """
-    # Get IDs of users already swiped on
-    swiped_ids = db.query(Swipe.target_user_id).filter(
-        Swipe.user_id == current_user.id
-    ).subquery()
-
-    # Get all users except current user and already swiped users
-    users = db.query(User).filter(
-        User.id != current_user.id,
-        ~User.id.in_(swiped_ids)
-    ).all()
+    1 where the skill gap is within each preferred_skill_range, 0 where it isn't.
+    A range that allows every level fits even an unknown gap; a limited one scores it as unknown.
+    """
+    max_gaps = np.array([SKILL_RANGE_MAX_GAP.get(str(value).lower(), np.inf) for value in preferred_ranges], dtype=float)
+    fit = ((gaps <= max_gaps) | np.isinf(max_gaps)).astype(float)
+    return np.where(np.isnan(gaps) & np.isfinite(max_gaps), UNKNOWN_COMPONENT_SCORE, fit)
+
+
+def style_membership(style_lists: list, vocabulary: dict) -> np.ndarray:
+    """(candidates x vocabulary) boolean matrix of which styles each candidate lists"""
+    matrix = np.zeros((len(style_lists), len(vocabulary)), dtype=bool)
+    for row, styles in enumerate(style_lists):
+        for style in styles:
+            column = vocabulary.get(style)
+            if column is not None:
+                matrix[row, column] = True
+    return matrix
+
+
+def compatibility_scores(current_user: User, candidates: list, distances: np.ndarray = None) -> np.ndarray:
+    """
+    Score how well each candidate suits the current user, in one vectorized pass.
+    Candidates only need the attributes used here, so users or plain rows both work.
+    The score is the COMPATIBILITY_WEIGHTS-weighted sum of:
+      weight_class - closeness of the weight classes
+      skill_level  - closeness of the skill levels
+      styles       - candidate practises what the user prefers, and the other way round
+      distance     - nearer is better, relative to the user's preferred_distance
+      skill_range  - the gap fits both users' preferred_skill_range
+    """
+    count = len(candidates)
+    if not count:
+        return np.zeros(0)
+
+    weight_positions = ordinal_positions([c.weight_class for c in candidates], WEIGHT_CLASS_ORDER)
+    own_weight = ordinal_positions([current_user.weight_class], WEIGHT_CLASS_ORDER)[0]
+    weight_score = scale_proximity(weight_positions, own_weight, len(WEIGHT_CLASS_ORDER) - 1)
+
+    skill_positions = ordinal_positions([c.skill_level for c in candidates], SKILL_LEVEL_ORDER, SKILL_LEVEL_ALIASES)
+    own_skill = ordinal_positions([current_user.skill_level], SKILL_LEVEL_ORDER, SKILL_LEVEL_ALIASES)[0]
+    skill_score = scale_proximity(skill_positions, own_skill, len(SKILL_LEVEL_ORDER) - 1)
+
+    skill_gaps = np.abs(skill_positions - own_skill)
+    range_score = (
+        skill_range_fit([current_user.preferred_skill_range] * count, skill_gaps) +
+        skill_range_fit([getattr(c, "preferred_skill_range", None) for c in candidates], skill_gaps)
+    ) / 2
+
+    # Styles only matter through the current user's own lists, so that's the whole vocabulary
+    own_arts = style_list(current_user.martial_arts)
+    own_preferred = style_list(current_user.preferred_styles)
+    vocabulary = {style: column for column, style in enumerate(dict.fromkeys(own_arts + own_preferred))}
+    candidate_preferred = [style_list(c.preferred_styles) for c in candidates]
+
+    if own_preferred:
+        wanted = np.array([style in own_preferred for style in vocabulary], dtype=float)
+        practised = style_membership([style_list(c.martial_arts) for c in candidates], vocabulary)
+        wants_score = practised @ wanted / wanted.sum()
+    else:
+        wants_score = np.full(count, UNKNOWN_COMPONENT_SCORE)
+
+    offered = np.array([style in own_arts for style in vocabulary], dtype=float)
+    preferred_counts = np.array([len(styles) for styles in candidate_preferred], dtype=float)
+    offers = style_membership(candidate_preferred, vocabulary) @ offered if vocabulary else np.zeros(count)
+    offers_score = np.where(preferred_counts > 0, offers / np.maximum(preferred_counts, 1), UNKNOWN_COMPONENT_SCORE)
+    styles_score = (wants_score + offers_score) / 2
+
+    if distances is None and current_user.latitude is not None and current_user.longitude is not None:
+        distances = haversine_distances(
+            current_user.latitude,
+            current_user.longitude,
+            [c.latitude if c.latitude is not None else np.nan for c in candidates],
+            [c.longitude if c.longitude is not None else np.nan for c in candidates]
+        )
+    if distances is None:
+        distance_score = np.full(count, UNKNOWN_COMPONENT_SCORE)
+    else:
+        preferred_distance = current_user.preferred_distance or 50
+        distance_score = np.where(np.isnan(distances), UNKNOWN_COMPONENT_SCORE, 1 / (1 + distances / preferred_distance))
+
+    scores = (
+        COMPATIBILITY_WEIGHTS["weight_class"] * weight_score +
+        COMPATIBILITY_WEIGHTS["skill_level"] * skill_score +
+        COMPATIBILITY_WEIGHTS["styles"] * styles_score +
+        COMPATIBILITY_WEIGHTS["distance"] * distance_score +
+        COMPATIBILITY_WEIGHTS["skill_range"] * range_score
+    )
+    # Rounded so scores compare exactly when used in pagination cursors
+    return np.round(scores, 4)
+
+
+# Candidates are ranked in pools of up to DISCOVER_RANK_POOL_SIZE unswiped users, taken
+# in scan order: users within the preferred distance first, then everyone else, newest
+# first within each. The feed shows the pools one after another, each best first, so a
+# page never has to score more than a pool or two whatever the size of the users table.
+DISCOVER_RANK_POOL_SIZE = int(os.getenv("DISCOVER_RANK_POOL_SIZE", "2000"))
+DISCOVER_NEARBY_PHASE, DISCOVER_EVERYONE_PHASE = 0, 1
+DISCOVER_TOP_POOL = (DISCOVER_NEARBY_PHASE, None)  # Scan position (phase, last id taken) of the first pool
+DISCOVER_NO_ID = np.iinfo(np.int64).max  # Stands in for "no id yet" in scan positions, sorting first
+
+
+def scan_discover_candidates(current_user: User, db: Session, condition, limit: int,
+                             skip_ids: np.ndarray, after_id: Optional[int] = None) -> list:
+    """
+    Scoring columns of up to limit candidates matching condition with ids below after_id,
+    newest first, skipping the sorted skip_ids. Reads by id in keyset pages, so the rows
+    touched are bounded by limit plus the number of skipped users, not the table size.
+    """
+    rows = []
+    last_id = after_id
+    while len(rows) < limit:
+        query = select(
+            User.id, User.weight_class, User.skill_level, User.preferred_skill_range,
+            User.martial_arts, User.preferred_styles, User.latitude, User.longitude
+        ).where(User.id != current_user.id)
+        if condition is not None:
+            query = query.where(condition)
+        if last_id is not None:
+            query = query.where(User.id < last_id)
+        page = db.execute(query.order_by(User.id.desc()).limit(limit)).all()
+        if not page:
+            break
+
+        last_id = page[-1].id
+        page_ids = np.fromiter((row.id for row in page), dtype=np.int64, count=len(page))
+        keep = ~swiped_mask(page_ids, skip_ids)
+        rows.extend(row for row, kept in zip(page, keep) if kept)
+        if len(page) < limit:
+            break
+    return rows[:limit]
+
+
+def discover_phase_condition(current_user: User, phase: int):
+    """SQL condition for the candidates of a scan phase, None for everyone"""
+    if current_user.latitude is None or current_user.longitude is None:
+        return None
+    nearby = geo_radius_prefilter(
+        current_user.latitude, current_user.longitude, current_user.preferred_distance or 50
+    )
+    if phase == DISCOVER_NEARBY_PHASE:
+        return nearby
+    # Exact complement of the nearby phase, counting users without a location as not nearby
+    return not_(func.coalesce(nearby, false()))
+
+
+def rank_discover_pool(current_user: User, db: Session, pool: tuple) -> tuple:
+    """
+    Rank the pool of up to DISCOVER_RANK_POOL_SIZE unswiped candidates that starts at scan
+    position pool. Returns (ids, scores, next pool): ids and compatibility scores best first
+    (ties broken by id, descending), and the scan position of the following pool, or None
+    when the scan reached the end. Only the columns used for scoring are loaded.
+    """
+    skip_ids = get_swiped_ids(current_user.id, db)
+    phase, after_id = pool
+    if phase == DISCOVER_NEARBY_PHASE and discover_phase_condition(current_user, phase) is None:
+        # Without a location every candidate is in the second phase
+        phase, after_id = DISCOVER_EVERYONE_PHASE, None
+
+    rows = []
+    next_pool = None
+    while True:
+        wanted = DISCOVER_RANK_POOL_SIZE - len(rows)
+        scanned = scan_discover_candidates(
+            current_user, db, discover_phase_condition(current_user, phase), wanted, skip_ids, after_id
+        )
+        rows += scanned
+        if len(scanned) == wanted:
+            next_pool = (phase, scanned[-1].id)
+            break
+        if phase == DISCOVER_EVERYONE_PHASE:
+            break
+        phase, after_id = DISCOVER_EVERYONE_PHASE, None
+
+    candidate_ids = np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+    scores = compatibility_scores(current_user, rows)
+    order = np.lexsort((-candidate_ids, -scores))
+    return candidate_ids[order], scores[order], next_pool
+
+
+def discover_candidates_query(current_user: User, db: Session):
+    """Base discover query: everyone except the current user. Swiped users are removed with load_unswiped_users."""
+    return db.query(User).filter(User.id != current_user.id)
+
+
+def parse_discover_cursor(cursor: str) -> dict:
+    """Decode a discover cursor: the pool, score and id of the last user of the previous page"""
+    values = decode_cursor(cursor)
+    pool, score, user_id = values.get("pool"), values.get("score"), values.get("id")
+    if (not isinstance(pool, list) or len(pool) != 2 or pool[0] not in (DISCOVER_NEARBY_PHASE, DISCOVER_EVERYONE_PHASE)
+            or not (pool[1] is None or isinstance(pool[1], int))
+            or not isinstance(score, (int, float)) or not isinstance(user_id, int)):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"pool": tuple(pool), "score": score, "id": user_id}
+
+
+def discover_feed_key(position: Optional[dict]) -> tuple:
+    """Sort key of a cursor position in feed order; None is the start of the feed"""
+    if position is None:
+        return (-1,)
+    phase, after_id = position["pool"]
+    return (phase, -(DISCOVER_NO_ID if after_id is None else after_id), -position["score"], -position["id"])
+
+
+# Precomputed discover decks: a window of the next DISCOVER_DECK_SIZE ranked candidates
+# of each recently active user, kept per process. Decks are built by a background worker,
+# trimmed as the user swipes, refreshed when they run low or get old, and dropped
+# when the user's profile or location changes.
+DISCOVER_DECK_SIZE = int(os.getenv("DISCOVER_DECK_SIZE", "200"))
+DISCOVER_DECK_REFILL_AT = int(os.getenv("DISCOVER_DECK_REFILL_AT", "40"))  # Rebuild when fewer candidates remain
+DISCOVER_DECK_REFRESH_SECONDS = int(os.getenv("DISCOVER_DECK_REFRESH_SECONDS", "300"))  # Rebuild decks older than this
+DISCOVER_DECK_IDLE_SECONDS = int(os.getenv("DISCOVER_DECK_IDLE_SECONDS", "1800"))  # Forget users inactive this long
+DISCOVER_DECK_MAX_USERS = int(os.getenv("DISCOVER_DECK_MAX_USERS", "10000"))
+
+
+class DiscoverDeck:
+    """
+    Ranked candidates in feed order, each with the scan position of its pool (phase and
+    last id taken; DISCOVER_NO_ID for the first pool of a phase). The deck holds every
+    candidate after start (a cursor position, None for the top of the feed) up to end,
+    the position of the last candidate ranked into it.
+    """
+
+    def __init__(self, candidate_ids: np.ndarray, scores: np.ndarray, pool_phases: np.ndarray,
+                 pool_after_ids: np.ndarray, start: Optional[dict], complete: bool):
+        self.candidate_ids = candidate_ids
+        self.scores = scores
+        self.pool_phases = pool_phases
+        self.pool_after_ids = pool_after_ids
+        self.start = start
+        self.complete = complete  # False when ranked candidates beyond the deck were cut off
+        self.built_at = time.monotonic()
+        self.end = self.last_position()
+
+    def covers(self, position: Optional[dict]) -> bool:
+        return discover_feed_key(position) >= discover_feed_key(self.start)
+
+    def arrays(self) -> tuple:
+        return self.candidate_ids, self.scores, self.pool_phases, self.pool_after_ids
+
+    def last_position(self) -> Optional[dict]:
+        if not len(self.candidate_ids):
+            return self.start
+        after_id = int(self.pool_after_ids[-1])
+        return {
+            "pool": (int(self.pool_phases[-1]), None if after_id == DISCOVER_NO_ID else after_id),
+            "score": float(self.scores[-1]),
+            "id": int(self.candidate_ids[-1])
+        }
+
+    def advance(self, position: dict):
+        """Drop the candidates up to position, which the user has paged past"""
+        self.candidate_ids, self.scores, self.pool_phases, self.pool_after_ids = after_discover_position(
+            self.arrays(), position
+        )
+        self.start = position
+
+    def extend(self, window: "DiscoverDeck"):
+        """Append a window ranked from this deck's end"""
+        self.candidate_ids, self.scores, self.pool_phases, self.pool_after_ids = (
+            np.concatenate(columns) for columns in zip(self.arrays(), window.arrays())
+        )
+        self.complete = window.complete
+        self.end = window.end
+
+
+def after_discover_position(arrays: tuple, position: Optional[dict]) -> tuple:
+    """The deck arrays restricted to candidates ranked after position"""
+    if position is None:
+        return arrays
+    candidate_ids, scores, pool_phases, pool_after_ids = arrays
+    phase, after_id = position["pool"]
+    after_id = DISCOVER_NO_ID if after_id is None else after_id
+    same_pool = (pool_phases == phase) & (pool_after_ids == after_id)
+    later_pool = (pool_phases > phase) | ((pool_phases == phase) & (pool_after_ids < after_id))
+    later = later_pool | (same_pool & (
+        (scores < position["score"]) | ((scores == position["score"]) & (candidate_ids < position["id"]))
+    ))
+    return tuple(array[later] for array in arrays)
+
+
+def rank_discover_window(user: User, db: Session, start: Optional[dict]) -> DiscoverDeck:
+    """Rank the DISCOVER_DECK_SIZE candidates that follow start in the feed, pool by pool"""
+    pool = start["pool"] if start else DISCOVER_TOP_POOL
+    parts = []
+    wanted = DISCOVER_DECK_SIZE
+    complete = False
+    while True:
+        candidate_ids, scores, next_pool = rank_discover_pool(user, db, pool)
+        phase, after_id = pool
+        pool_arrays = (
+            candidate_ids, scores,
+            np.full(len(candidate_ids), phase, dtype=np.int64),
+            np.full(len(candidate_ids), DISCOVER_NO_ID if after_id is None else after_id, dtype=np.int64)
+        )
+        if start is not None and pool == start["pool"]:
+            pool_arrays = after_discover_position(pool_arrays, start)
+        parts.append(tuple(array[:wanted] for array in pool_arrays))
+        wanted -= len(parts[-1][0])
+        if wanted <= 0 and (len(pool_arrays[0]) > len(parts[-1][0]) or next_pool is not None):
+            break
+        if next_pool is None:
+            complete = True
+            break
+        pool = next_pool
+
+    arrays = tuple(np.concatenate(columns) for columns in zip(*parts))
+    return DiscoverDeck(*arrays, start=start, complete=complete)
+
+
+# Decks are re-inserted on every read (get_discover_deck), so the TTL measures idle time
+discover_decks = TTLCache(maxsize=DISCOVER_DECK_MAX_USERS, ttl=DISCOVER_DECK_IDLE_SECONDS)
+discover_decks_lock = threading.Lock()
+# Per-user generation, bumped on every invalidation; a deck is only stored if it was
+# built in the generation that is still current. Values come from one increasing sequence
+# so a generation is never reused, even after its entry expires.
+discover_deck_generations = TTLCache(maxsize=DISCOVER_DECK_MAX_USERS, ttl=DISCOVER_DECK_IDLE_SECONDS)
+discover_deck_generation_sequence = itertools.count(1)
+discover_deck_queue = queue.Queue()
+discover_deck_pending = {}  # Users queued for a rebuild (False) or an extension (True), so each is queued once
+
+
+def get_discover_deck(user_id: int):
+    """The user's deck, if any, keeping it from expiring while it's in use"""
+    with discover_decks_lock:
+        deck = discover_decks.get(user_id)
+        if deck is not None:
+            discover_decks[user_id] = deck
+        return deck
+
+
+def build_discover_deck(user: User, db: Session, start: Optional[dict] = None) -> DiscoverDeck:
+    """Rank a deck for the user from start and store it, unless the deck was invalidated while it was being built"""
+    with discover_decks_lock:
+        generation = discover_deck_generations.get(user.id)
+
+    deck = rank_discover_window(user, db, start)
+    with discover_decks_lock:
+        if discover_deck_generations.get(user.id) == generation:
+            discover_decks[user.id] = deck
+    return deck
+
+
+def extend_discover_deck(user: User, db: Session):
+    """Rank the window after the end of the user's deck and append it, unless the deck was replaced or invalidated meanwhile"""
+    with discover_decks_lock:
+        deck = discover_decks.get(user.id)
+        generation = discover_deck_generations.get(user.id)
+        if deck is None or deck.complete:
+            return
+        end = deck.end
+
+    window = rank_discover_window(user, db, end)
+    with discover_decks_lock:
+        if discover_deck_generations.get(user.id) == generation and discover_decks.get(user.id) is deck:
+            deck.extend(window)
+
+
+def request_discover_deck(user_id: int, extend: bool = False):
+    """
+    Queue a background rebuild of a user's deck, from the same start as the current one,
+    or with extend, ranking more candidates onto its end. A rebuild wins over an extension.
+    """
+    with discover_decks_lock:
+        if user_id in discover_deck_pending:
+            discover_deck_pending[user_id] = discover_deck_pending[user_id] and extend
+            return
+        discover_deck_pending[user_id] = extend
+    discover_deck_queue.put(user_id)
+
+
+def invalidate_discover_deck(user_id: int):
+    """Drop a user's deck after their profile or location changed, and start rebuilding it"""
+    with discover_decks_lock:
+        discover_deck_generations[user_id] = next(discover_deck_generation_sequence)
+        was_active = discover_decks.pop(user_id, None) is not None
+    if was_active:
+        request_discover_deck(user_id)
+
+
+def discard_from_discover_deck(user_id: int, target_ids: list):
+    """Remove users that were just swiped on from the front of the swiper's deck"""
+    with discover_decks_lock:
+        deck = discover_decks.get(user_id)
+        if deck is None:
+            return
+        keep = ~np.isin(deck.candidate_ids, np.asarray(target_ids, dtype=np.int64))
+        deck.candidate_ids, deck.scores, deck.pool_phases, deck.pool_after_ids = (
+            array[keep] for array in deck.arrays()
+        )
+        remaining = len(deck.candidate_ids)
+
+    if remaining < DISCOVER_DECK_REFILL_AT and not deck.complete:
+        request_discover_deck(user_id, extend=True)
+
+
+def run_discover_deck_worker():
+    """Build or extend queued decks, each in its own session"""
+    while True:
+        user_id = discover_deck_queue.get()
+        with discover_decks_lock:
+            extend = discover_deck_pending.pop(user_id, False)
+            deck = discover_decks.get(user_id)
+        db = SessionLocal()
+        try:
+            user = db.get(User, user_id)
+            if user is not None and extend and deck is not None:
+                extend_discover_deck(user, db)
+            elif user is not None:
+                build_discover_deck(user, db, deck.start if deck is not None else None)
+        except Exception as e:
+            db.rollback()
+            print(f"Error building discover deck for user {user_id}: {e}")
+        finally:
+            db.close()
+            discover_deck_queue.task_done()
+
+
+@app.on_event("startup")
+def start_discover_deck_worker():
+    threading.Thread(target=run_discover_deck_worker, name="discover-decks", daemon=True).start()
+
+
+@app.get("/users/discover", response_model=List[DiscoverUserResponse])
+def discover_users(
+        response: Response,
+        limit: int = DISCOVER_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        current_user: User = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    """
+    Get a page of users that haven't been swiped on yet, most compatible first.
+
+    Users are ranked by compatibility_score (see compatibility_scores) pool by pool
+    (see rank_discover_pool) and served from the user's precomputed deck. When more
+    candidates remain, the token for the next page is returned in the X-Next-Cursor
+    response header.
+    """
+    limit = max(1, min(limit, DISCOVER_MAX_PAGE_SIZE))
+    position = parse_discover_cursor(cursor) if cursor else None
+
+    deck = get_discover_deck(current_user.id)
+    if deck is None or not deck.covers(position):
+        # First visit in a while, or a page outside the deck: rank now and keep the deck for the following requests
+        deck = build_discover_deck(current_user, db, position)
+    elif time.monotonic() - deck.built_at > DISCOVER_DECK_REFRESH_SECONDS:
+        # Serve the current deck, a fresh one picks up new and updated users
+        request_discover_deck(current_user.id)
+
+    def page_candidates(deck):
+        with discover_decks_lock:
+            arrays, complete = deck.arrays(), deck.complete
+        # Swipes made while the deck was being built may not have been trimmed from it yet
+        unswiped = ~swiped_mask(arrays[0], get_swiped_ids(current_user.id, db))
+        return after_discover_position(tuple(array[unswiped] for array in arrays), position), complete
+
+    arrays, complete = page_candidates(deck)
+    if not len(arrays[0]) and not complete:
+        # Paged past the end of the deck before it was extended: rank the window that follows the cursor
+        deck = build_discover_deck(current_user, db, position)
+        arrays, complete = page_candidates(deck)
+    elif len(arrays[0]) < limit + DISCOVER_DECK_REFILL_AT and not complete:
+        # Close to the end of the deck: rank more in the background, ahead of the next pages
+        if position is not None:
+            with discover_decks_lock:
+                deck.advance(position)
+        request_discover_deck(current_user.id, extend=True)
+
+    candidate_ids, scores, pool_phases, pool_after_ids = (array[:limit] for array in arrays)
+    page_ids = candidate_ids.tolist()
+    users_by_id = {user.id: user for user in db.query(User).filter(User.id.in_(page_ids)).all()}
+    users = []
+    for user_id, score in zip(page_ids, scores.tolist()):
+        user = users_by_id.get(user_id)
+        if user is not None:
+            user.compatibility_score = score
+            users.append(user)
+
+    if page_ids and (len(arrays[0]) > limit or not complete):
+        last_after_id = int(pool_after_ids[-1])
+        response.headers["X-Next-Cursor"] = encode_cursor({
+            "pool": [int(pool_phases[-1]), None if last_after_id == DISCOVER_NO_ID else last_after_id],
+            "score": float(scores[-1]),
+            "id": page_ids[-1]
+        })
 
     return users
 
 
 # UPDATED: Optional filtered discover endpoint (also excludes swiped users)
 @app.post("/users/discover/filter")
-async def discover_users_filtered(
+def discover_users_filtered(
         filters: DiscoverFilters,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
     """Discover users with advanced filtering (excludes already swiped users)"""
 
-    # Get users that haven't been swiped on yet
-    swiped_ids = db.query(Swipe.target_user_id).filter(
-        Swipe.user_id == current_user.id
-    ).subquery()
-
     # Start with base query - exclude current user and swiped users
-    query = db.query(User).filter(
-        User.id != current_user.id,
-        ~User.id.in_(swiped_ids)
-    )
+    query = discover_candidates_query(current_user, db)
 
     # Apply filters only if provided
 
@@ -1231,44 +2733,51 @@ async def discover_users_filtered(
     if filters.experience_max is not None:
         query = query.filter(User.experience_years <= filters.experience_max)
 
-    # Get all users that match basic filters
-    users = query.all()
+    # Prune to the bounding box around the current user before computing exact distances
+    if filters.max_distance and current_user.latitude is not None and current_user.longitude is not None:
+        query = query.filter(
+            geo_radius_prefilter(current_user.latitude, current_user.longitude, filters.max_distance)
+        )
 
-    # Apply martial arts filter (stored as JSON array)
+    # Filter by martial arts - user needs at least one of the requested styles
     if filters.martial_arts:
-        filtered_users = []
-        for user in users:
-            user_martial_arts = user.martial_arts if isinstance(user.martial_arts, list) else []
-            # Check if user has at least one of the requested martial arts
-            if any(ma in user_martial_arts for ma in filters.martial_arts):
-                filtered_users.append(user)
-        users = filtered_users
-
-    # Apply distance filter
-    if filters.max_distance and current_user.latitude and current_user.longitude:
-        users_with_distance = []
-        for user in users:
-            if user.latitude and user.longitude:
-                distance = calculate_distance(
-                    current_user.latitude,
-                    current_user.longitude,
-                    user.latitude,
-                    user.longitude
-                )
-                if distance and distance <= filters.max_distance:
-                    users_with_distance.append(user)
-        users = users_with_distance
+        query = query.filter(User.style_entries.any(UserStyle.style.in_(filters.martial_arts)))
 
-    # Apply availability filter
+    # Filter by availability on the requested day
     if filters.day_of_week:
-        filtered_by_availability = []
-        for user in users:
-            if user.availability:
-                availability = user.availability if isinstance(user.availability, dict) else {}
-                # Check if user has availability on the requested day
-                if filters.day_of_week.lower() in availability and availability[filters.day_of_week.lower()]:
-                    filtered_by_availability.append(user)
-        users = filtered_by_availability
+        query = query.filter(User.available_days.any(UserAvailableDay.day == filters.day_of_week.lower()))
+
+    # Get all users that match the filters; swiped users are dropped before their rows are loaded
+    users = load_unswiped_users(query, get_swiped_ids(current_user.id, db))
+
+    # Attach distance_km and compatibility_score, then apply distance filter / sort in one vectorized pass
+    distances = None
+    if current_user.latitude is not None and current_user.longitude is not None and users:
+        distances = haversine_distances(
+            current_user.latitude,
+            current_user.longitude,
+            [user.latitude if user.latitude is not None else np.nan for user in users],
+            [user.longitude if user.longitude is not None else np.nan for user in users]
+        )
+    scores = compatibility_scores(current_user, users, distances)
+
+    keep = np.ones(len(users), dtype=bool)
+    if distances is not None and filters.max_distance:
+        keep = ~np.isnan(distances) & (distances <= filters.max_distance)
+
+    order = np.flatnonzero(keep)
+    if filters.sort_by == "distance" and distances is not None:
+        # NaN sorts last, so users without a location end up at the bottom
+        order = order[np.argsort(distances[order], kind="stable")]
+    else:
+        # Most compatible first
+        order = order[np.argsort(-scores[order], kind="stable")]
+
+    for index in order:
+        users[index].compatibility_score = float(scores[index])
+        if distances is not None:
+            users[index].distance_km = None if np.isnan(distances[index]) else round(float(distances[index]), 1)
+    users = [users[index] for index in order]
 
     return users
 
@@ -1279,7 +2788,7 @@ class LocationUpdate(BaseModel):
 
 
 @app.put("/users/me/location")
-async def update_location(
+def update_location(
         location: LocationUpdate,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
@@ -1287,9 +2796,11 @@ async def update_location(
     """Update user's location for distance filtering"""
     current_user.latitude = location.latitude
     current_user.longitude = location.longitude
+    current_user.geo_cell = geo_cell_for(location.latitude, location.longitude)
 
     db.commit()
     db.refresh(current_user)
+    invalidate_discover_deck(current_user.id)
 
     return {"message": "Location updated successfully"}
 
@@ -1300,13 +2811,14 @@ class AvailabilityUpdate(BaseModel):
 
 
 @app.put("/users/me/availability")
-async def update_availability(
+def update_availability(
         availability_data: AvailabilityUpdate,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
     """Update user's availability schedule"""
     current_user.availability = availability_data.availability
+    sync_discover_search_rows(current_user)
 
     db.commit()
     db.refresh(current_user)
@@ -1342,7 +2854,7 @@ def get_filter_options():
 
 
 @app.put("/users/me/record")
-async def update_fight_record(
+def update_fight_record(
         record: FightRecordUpdate,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
@@ -1350,21 +2862,19 @@ async def update_fight_record(
     current_user.wins = record.wins
     current_user.losses = record.losses
     current_user.draws = record.draws
+    sync_record_to_stats(get_fighter_stats(current_user.id, db), current_user)
+
+    # Sync to Firebase
+    queue_firestore_write(db, 'users', current_user.id, {
+        'wins': current_user.wins,
+        'losses': current_user.losses,
+        'draws': current_user.draws,
+        'updated_at': firestore.SERVER_TIMESTAMP
+    })
 
     db.commit()
     db.refresh(current_user)
 
-    # ✅ ADD THIS: Sync to Firebase
-    try:
-        firebase_db.collection('users').document(str(current_user.id)).update({
-            'wins': current_user.wins,
-            'losses': current_user.losses,
-            'draws': current_user.draws,
-            'updated_at': firestore.SERVER_TIMESTAMP
-        })
-    except Exception as e:
-        print(f"Error syncing fight record to Firebase: {e}")
-
     return {
         "wins": current_user.wins,
         "losses": current_user.losses,
@@ -1373,64 +2883,217 @@ async def update_fight_record(
     }
 
 
+# Per-user cache of match ids for chat and fight authorization. Matches are only ever
+# added, so a cached hit is always valid; a miss is confirmed against the database
+# in case the match was made after the set was cached (e.g. by another worker).
+MATCH_CACHE_TTL_SECONDS = int(os.getenv("MATCH_CACHE_TTL_SECONDS", "300"))
+MATCH_CACHE_SIZE = int(os.getenv("MATCH_CACHE_SIZE", "10000"))
+match_cache = TTLCache(maxsize=MATCH_CACHE_SIZE, ttl=MATCH_CACHE_TTL_SECONDS)
+match_cache_lock = threading.Lock()
+
+
+def get_match_ids(user_id: int, db: Session) -> frozenset:
+    """Ids of everyone the user is matched with (cached)"""
+    with match_cache_lock:
+        match_ids = match_cache.get(user_id)
+
+    if match_ids is None:
+        # Range scan on the (user_id, matched_user_id) primary key
+        match_ids = frozenset(db.execute(
+            select(matches_table.c.matched_user_id).where(matches_table.c.user_id == user_id)
+        ).scalars())
+        with match_cache_lock:
+            match_cache[user_id] = match_ids
+
+    return match_ids
+
+
+def is_matched(user_id: int, other_user_id: int, db: Session) -> bool:
+    if other_user_id in get_match_ids(user_id, db):
+        return True
+
+    # Primary key lookup
+    exists = db.execute(
+        select(matches_table.c.user_id).where(
+            matches_table.c.user_id == user_id,
+            matches_table.c.matched_user_id == other_user_id
+        ).limit(1)
+    ).first() is not None
+    if exists:
+        invalidate_match_cache(user_id)
+    return exists
+
+
+def invalidate_match_cache(*user_ids: int):
+    with match_cache_lock:
+        for user_id in user_ids:
+            match_cache.pop(user_id, None)
+
+
+def match_event_data(other_user: User) -> dict:
+    return {
+        "user_id": other_user.id,
+        "username": other_user.username,
+        "full_name": other_user.full_name,
+        "profile_pic": other_user.profile_pic
+    }
+
+
+SWIPE_BATCH_MAX = 100
+
+
+def insert_ignoring_conflicts(table, rows: list, index_elements: list):
+    """INSERT ... ON CONFLICT DO NOTHING for the current dialect"""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table).values(rows).on_conflict_do_nothing(index_elements=index_elements)
+
+
+@app.on_event("startup")
+def check_swipe_unique_index():
+    """
+    record_swipes relies on ON CONFLICT (user_id, target_user_id), which needs the unique index.
+    create_all doesn't add it to a swipes table created before it was declared, so refuse to start
+    rather than fail every swipe.
+    """
+    inspector = inspect(engine)
+    swipe_keys = ["user_id", "target_user_id"]
+    unique_keys = [index["column_names"] for index in inspector.get_indexes("swipes") if index["unique"]]
+    unique_keys += [constraint["column_names"] for constraint in inspector.get_unique_constraints("swipes")]
+    if swipe_keys not in unique_keys:
+        raise RuntimeError(
+            "The swipes table has no unique (user_id, target_user_id) index. "
+            "Run backend/migrate_indexes.py to remove duplicate swipes and create it."
+        )
+
+
+def record_swipes(current_user: User, decisions: dict, db: Session) -> tuple:
+    """
+    Store swipes ({target user id: is_like}) and create the matches they complete.
+    Swipes on users already swiped are ignored. Returns (number of swipes recorded,
+    newly matched users).
+    """
+    if not decisions:
+        return 0, []
+
+    # One statement for all swipes; RETURNING only yields rows that were actually inserted
+    recorded = db.execute(
+        insert_ignoring_conflicts(Swipe.__table__, [
+            {"user_id": current_user.id, "target_user_id": target_id, "is_like": is_like}
+            for target_id, is_like in decisions.items()
+        ], ["user_id", "target_user_id"]).returning(Swipe.target_user_id, Swipe.is_like)
+    ).all()
+    new_like_ids = [target_id for target_id, is_like in recorded if is_like]
+
+    if recorded:
+        add_swiped_ids(current_user.id, [target_id for target_id, _ in recorded], db)
+
+    matched_users = []
+    if new_like_ids:
+        # Every new like that is answered by an existing like is a match
+        matched_users = db.query(User).join(Swipe, and_(
+            Swipe.user_id == User.id,
+            Swipe.target_user_id == current_user.id,
+            Swipe.is_like == True
+        )).filter(User.id.in_(new_like_ids)).all()
+
+    if matched_users:
+        # Add to matches table, both directions in one statement
+        db.execute(insert_ignoring_conflicts(matches_table, [
+            row
+            for user in matched_users
+            for row in (
+                {"user_id": current_user.id, "matched_user_id": user.id, "created_at": datetime.utcnow()},
+                {"user_id": user.id, "matched_user_id": current_user.id, "created_at": datetime.utcnow()},
+            )
+        ], ["user_id", "matched_user_id"]))
+
+        # Sync matches to Firebase
+        for target_user in matched_users:
+            match_id = f"match_{min(current_user.id, target_user.id)}_{max(current_user.id, target_user.id)}"
+            queue_firestore_write(db, 'matches', match_id, {
+                'user1_id': current_user.id,
+                'user2_id': target_user.id,
+                'user1_name': current_user.username,
+                'user2_name': target_user.username,
+                'matched_at': firestore.SERVER_TIMESTAMP
+            }, merge=False)
+
+    db.commit()
+
+    if recorded:
+        discard_from_discover_deck(current_user.id, [target_id for target_id, _ in recorded])
+
+    if matched_users:
+        invalidate_match_cache(current_user.id, *(user.id for user in matched_users))
+        # The matches relationship was loaded before the rows were inserted
+        db.expire(current_user, ["matches"])
+
+        for target_user in matched_users:
+            event_broker.publish(current_user.id, "match", match_event_data(target_user))
+            event_broker.publish(target_user.id, "match", match_event_data(current_user))
+
+        trigger_achievement_check(current_user.id, "match_created", db)
+        for target_user in matched_users:
+            trigger_achievement_check(target_user.id, "match_created", db)
+
+    return len(recorded), matched_users
+
+
 @app.post("/swipe")
-async def swipe(
+def swipe(
         swipe_data: SwipeRequest,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
-    # Check if already swiped
-    existing_swipe = db.query(Swipe).filter(
-        Swipe.user_id == current_user.id,
-        Swipe.target_user_id == swipe_data.target_user_id
-    ).first()
+    if not db.get(User, swipe_data.target_user_id):
+        raise HTTPException(status_code=404, detail="User not found")
 
-    if existing_swipe:
+    recorded, matched_users = record_swipes(
+        current_user, {swipe_data.target_user_id: swipe_data.is_like}, db
+    )
+
+    if not recorded:
         raise HTTPException(status_code=400, detail="Already swiped on this user")
 
-    # Create new swipe
-    new_swipe = Swipe(
-        user_id=current_user.id,
-        target_user_id=swipe_data.target_user_id,
-        is_like=swipe_data.is_like
-    )
-    db.add(new_swipe)
+    return {"match": bool(matched_users)}
 
-    # Check for mutual match
-    is_match = False
-    if swipe_data.is_like:
-        mutual_swipe = db.query(Swipe).filter(
-            Swipe.user_id == swipe_data.target_user_id,
-            Swipe.target_user_id == current_user.id,
-            Swipe.is_like == True
-        ).first()
 
-        if mutual_swipe:
-            is_match = True
-            # Add to matches table
-            target_user = db.query(User).filter(User.id == swipe_data.target_user_id).first()
-            current_user.matches.append(target_user)
-            target_user.matches.append(current_user)
+@app.post("/swipes/batch")
+def swipe_batch(
+        batch: SwipeBatchRequest,
+        current_user: User = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    """
+    Record up to SWIPE_BATCH_MAX swipes at once. Swipes on yourself, on unknown
+    users or on users already swiped are skipped; for repeated targets the last
+    decision wins. Returns the number recorded and the new matches.
+    """
+    if len(batch.swipes) > SWIPE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {SWIPE_BATCH_MAX} swipes per batch")
+
+    decisions = {
+        swipe_data.target_user_id: swipe_data.is_like
+        for swipe_data in batch.swipes
+        if swipe_data.target_user_id != current_user.id
+    }
+    if decisions:
+        existing_ids = set(db.execute(select(User.id).where(User.id.in_(decisions))).scalars())
+        decisions = {target_id: is_like for target_id, is_like in decisions.items() if target_id in existing_ids}
 
-            # ✅ ADD THIS: Sync match to Firebase
-            try:
-                match_id = f"match_{min(current_user.id, target_user.id)}_{max(current_user.id, target_user.id)}"
-                firebase_db.collection('matches').document(match_id).set({
-                    'user1_id': current_user.id,
-                    'user2_id': target_user.id,
-                    'user1_name': current_user.username,
-                    'user2_name': target_user.username,
-                    'matched_at': firestore.SERVER_TIMESTAMP
-                })
-            except Exception as e:
-                print(f"Error syncing match to Firebase: {e}")
+    recorded, matched_users = record_swipes(current_user, decisions, db)
 
-    db.commit()
-    return {"match": is_match}
+    return {
+        "recorded": recorded,
+        "matches": [match_event_data(user) for user in matched_users]
+    }
 
 
 @app.get("/matches", response_model=List[UserResponse])
-async def get_matches(
+def get_matches(
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
@@ -1438,17 +3101,13 @@ async def get_matches(
 
 
 @app.post("/fights/schedule")
-async def schedule_fight(
+def schedule_fight(
         fight_data: FightSchedule,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
     # Verify users are matched
-    is_matched = db.query(User).filter(
-        User.id == current_user.id
-    ).first().matches.filter(User.id == fight_data.opponent_id).first()
-
-    if not is_matched:
+    if not is_matched(current_user.id, fight_data.opponent_id, db):
         raise HTTPException(status_code=400, detail="Can only schedule fights with matches")
 
     new_fight = Fight(
@@ -1465,7 +3124,7 @@ async def schedule_fight(
 
 
 @app.get("/fights")
-async def get_fights(
+def get_fights(
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
@@ -1476,7 +3135,7 @@ async def get_fights(
 
 
 @app.get("/stats/{user_id}")
-async def get_user_stats(user_id: int, db: Session = Depends(get_db)):
+def get_user_stats(user_id: int, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -1499,7 +3158,7 @@ async def get_user_stats(user_id: int, db: Session = Depends(get_db)):
 
 
 @app.put("/users/me", response_model=UserResponse)
-async def update_user(
+def update_user(
         user_update: UserBase,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
@@ -1517,30 +3176,31 @@ async def update_user(
     current_user.skill_level = user_update.skill_level
     current_user.preferred_styles = user_update.preferred_styles
     current_user.weight_class = user_update.weight_class
+    sync_discover_search_rows(current_user)
+
+    # Sync to Firebase
+    queue_firestore_write(db, 'users', current_user.id, {
+        'username': current_user.username,
+        'email': current_user.email,
+        'full_name': current_user.full_name,
+        'age': current_user.age,
+        'height': current_user.height,
+        'weight': current_user.weight,
+        'location': current_user.location,
+        'bio': current_user.bio,
+        'martial_arts': current_user.martial_arts,
+        'experience_years': current_user.experience_years,
+        'skill_level': current_user.skill_level,
+        'preferred_styles': current_user.preferred_styles,
+        'weight_class': current_user.weight_class,
+        'updated_at': firestore.SERVER_TIMESTAMP
+    })
 
     db.commit()
     db.refresh(current_user)
+    invalidate_discover_deck(current_user.id)
 
-    # ✅ ADD THIS: Sync to Firebase
-    try:
-        firebase_db.collection('users').document(str(current_user.id)).update({
-            'username': current_user.username,
-            'email': current_user.email,
-            'full_name': current_user.full_name,
-            'age': current_user.age,
-            'height': current_user.height,
-            'weight': current_user.weight,
-            'location': current_user.location,
-            'bio': current_user.bio,
-            'martial_arts': current_user.martial_arts,
-            'experience_years': current_user.experience_years,
-            'skill_level': current_user.skill_level,
-            'preferred_styles': current_user.preferred_styles,
-            'weight_class': current_user.weight_class,
-            'updated_at': firestore.SERVER_TIMESTAMP
-        })
-    except Exception as e:
-        print(f"Error syncing user update to Firebase: {e}")
+    trigger_achievement_check(current_user.id, "profile_updated", db)
 
     return current_user
 
@@ -1551,70 +3211,48 @@ def get_analytics(current_user: User = Depends(get_current_user), db: Session =
 
     user = db.query(User).filter(User.id == current_user.id).first()
 
-    # Calculate win/loss streaks
-    fights = db.query(FightRecord).filter(
-        (FightRecord.user_id == user.id) | (FightRecord.opponent_id == user.id)
-    ).order_by(FightRecord.date.desc()).all()
-
-    current_streak = 0
-    longest_streak = 0
-    temp_streak = 0
-
-    for fight in fights:
-        is_winner = (fight.user_id == user.id and fight.result == "win") or \
-                    (fight.opponent_id == user.id and fight.result == "loss")
-
-        if is_winner:
-            temp_streak += 1
-            longest_streak = max(longest_streak, temp_streak)
-        else:
-            temp_streak = 0
-
-    # Current streak is the most recent
-    for fight in fights:
-        is_winner = (fight.user_id == user.id and fight.result == "win") or \
-                    (fight.opponent_id == user.id and fight.result == "loss")
-
-        if is_winner:
-            current_streak += 1
-        else:
-            break
+    stats = get_fighter_stats(user.id, db)
+    streaks = get_streaks(stats)
 
     # Calculate stats by martial art style
     style_stats = defaultdict(lambda: {"wins": 0, "losses": 0, "draws": 0})
 
-    for fight in fights:
-        if fight.martial_art_style:
-            style = fight.martial_art_style
-            is_user = fight.user_id == user.id
+    style_counts = db.query(
+        FightRecord.martial_art_style,
+        FightRecord.result,
+        FightRecord.user_id == user.id,
+        func.count(FightRecord.id)
+    ).filter(
+        (FightRecord.user_id == user.id) | (FightRecord.opponent_id == user.id),
+        FightRecord.martial_art_style.isnot(None),
+        FightRecord.martial_art_style != ""
+    ).group_by(
+        FightRecord.martial_art_style,
+        FightRecord.result,
+        FightRecord.user_id == user.id
+    ).all()
 
-            if fight.result == "win" and is_user:
-                style_stats[style]["wins"] += 1
-            elif fight.result == "loss" and is_user:
-                style_stats[style]["losses"] += 1
-            elif fight.result == "draw":
-                style_stats[style]["draws"] += 1
+    for style, result, is_user, count in style_counts:
+        if result == "win" and is_user:
+            style_stats[style]["wins"] += count
+        elif result == "loss" and is_user:
+            style_stats[style]["losses"] += count
+        elif result == "draw":
+            style_stats[style]["draws"] += count
 
     # Monthly activity (last 6 months)
     six_months_ago = datetime.utcnow() - timedelta(days=180)
     monthly_fights = defaultdict(int)
 
-    for fight in fights:
-        if fight.date >= six_months_ago:
-            month_key = fight.date.strftime("%Y-%m")
-            monthly_fights[month_key] += 1
-
-    # Calculate training frequency
-    training_days = set()
-    for fight in fights:
-        training_days.add(fight.date.date())
-
-    training_streak = 0
-    check_date = datetime.utcnow().date()
+    fight_year = func.extract("year", FightRecord.date)
+    fight_month = func.extract("month", FightRecord.date)
+    monthly_counts = db.query(fight_year, fight_month, func.count(FightRecord.id)).filter(
+        (FightRecord.user_id == user.id) | (FightRecord.opponent_id == user.id),
+        FightRecord.date >= six_months_ago
+    ).group_by(fight_year, fight_month).all()
 
-    while check_date in training_days:
-        training_streak += 1
-        check_date -= timedelta(days=1)
+    for year, month, count in monthly_counts:
+        monthly_fights[f"{int(year):04d}-{int(month):02d}"] += count
 
     total_fights = user.wins + user.losses + user.draws
     win_rate = (user.wins / total_fights * 100) if total_fights > 0 else 0
@@ -1625,12 +3263,12 @@ def get_analytics(current_user: User = Depends(get_current_user), db: Session =
         "losses": user.losses,
         "draws": user.draws,
         "win_rate": round(win_rate, 1),
-        "current_streak": current_streak,
-        "longest_streak": longest_streak,
+        "current_streak": streaks["current_streak"],
+        "longest_streak": streaks["longest_streak"],
         "style_stats": dict(style_stats),
         "monthly_activity": dict(monthly_fights),
-        "training_streak": training_streak,
-        "unique_training_days": len(training_days)
+        "training_streak": streaks["training_streak"],
+        "unique_training_days": stats.unique_training_days
     }
 
 
@@ -1640,58 +3278,12 @@ def get_profile_stats(current_user: User = Depends(get_current_user), db: Sessio
 
     user = db.query(User).filter(User.id == current_user.id).first()
 
-    # Get martial arts from user profile
-    if isinstance(user.martial_arts, list):
-        martial_arts = user.martial_arts
-    elif isinstance(user.martial_arts, str):
-        try:
-            martial_arts = json.loads(user.martial_arts)
-        except:
-            martial_arts = []
-    else:
-        martial_arts = []
-    styles_trained = len(martial_arts)
-
-    # Calculate streaks
-    fights = db.query(FightRecord).filter(
-        (FightRecord.user_id == user.id) | (FightRecord.opponent_id == user.id)
-    ).order_by(FightRecord.date.desc()).all()
-
-    current_streak = 0
-    longest_streak = 0
-    temp_streak = 0
+    styles_trained = len(get_martial_arts_list(user))
 
-    for fight in fights:
-        is_winner = (fight.user_id == user.id and fight.result == "win") or \
-                    (fight.opponent_id == user.id and fight.result == "loss")
-
-        if is_winner:
-            temp_streak += 1
-            longest_streak = max(longest_streak, temp_streak)
-        else:
-            temp_streak = 0
-
-    # Calculate current streak
-    for fight in fights:
-        is_winner = (fight.user_id == user.id and fight.result == "win") or \
-                    (fight.opponent_id == user.id and fight.result == "loss")
-
-        if is_winner:
-            current_streak += 1
-        else:
-            break
-
-    # Calculate training streak (consecutive days)
-    training_days = set()
-    for fight in fights:
-        training_days.add(fight.date.date())
-
-    training_streak = 0
-    check_date = datetime.utcnow().date()
-
-    while check_date in training_days:
-        training_streak += 1
-        check_date -= timedelta(days=1)
+    streaks = get_streaks(get_fighter_stats(user.id, db))
+    current_streak = streaks["current_streak"]
+    longest_streak = streaks["longest_streak"]
+    training_streak = streaks["training_streak"]
 
     total_fights = user.wins + user.losses + user.draws
     win_rate = (user.wins / total_fights * 100) if total_fights > 0 else 0
@@ -1712,27 +3304,64 @@ def get_profile_stats(current_user: User = Depends(get_current_user), db: Sessio
 # Get fight history
 @app.get("/fights/history")
 def get_fight_history(
+        response: Response,
         limit: int = 20,
+        cursor: Optional[str] = None,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
-    """Get user's fight history"""
+    """
+    Get user's fight history, newest first.
 
-    fights = db.query(FightRecord).filter(
+    Pages are keyed on (date, id); when more fights remain, the token for the
+    next page is returned in the X-Next-Cursor response header.
+    """
+    limit = max(1, min(limit, 100))
+
+    # Resolve every opponent in the same query
+    opponent_id = case(
+        (FightRecord.user_id == current_user.id, FightRecord.opponent_id),
+        else_=FightRecord.user_id
+    )
+
+    query = db.query(FightRecord, opponent_id, User.username).outerjoin(
+        User, User.id == opponent_id
+    ).filter(
         (FightRecord.user_id == current_user.id) | (FightRecord.opponent_id == current_user.id)
-    ).order_by(FightRecord.date.desc()).limit(limit).all()
+    )
+
+    if cursor:
+        position = decode_cursor(cursor)
+        try:
+            last_date = datetime.fromisoformat(position["date"])
+            last_id = int(position["id"])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(or_(
+            FightRecord.date < last_date,
+            and_(FightRecord.date == last_date, FightRecord.id < last_id)
+        ))
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.order_by(FightRecord.date.desc(), FightRecord.id.desc()).limit(limit + 1).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_fight = rows[-1][0]
+        response.headers["X-Next-Cursor"] = encode_cursor({
+            "date": last_fight.date.isoformat(),
+            "id": last_fight.id
+        })
 
     fight_history = []
 
-    for fight in fights:
+    for fight, fight_opponent_id, opponent_name in rows:
         is_user = fight.user_id == current_user.id
-        opponent_id = fight.opponent_id if is_user else fight.user_id
-        opponent = db.query(User).filter(User.id == opponent_id).first()
 
         fight_history.append({
             "id": fight.id,
-            "opponent_name": opponent.username if opponent else "Unknown",
-            "opponent_id": opponent_id,
+            "opponent_name": opponent_name or "Unknown",
+            "opponent_id": fight_opponent_id,
             "result": fight.result if is_user else (
                 "loss" if fight.result == "win" else "win" if fight.result == "loss" else "draw"),
             "martial_art_style": fight.martial_art_style,
@@ -1744,47 +3373,89 @@ def get_fight_history(
 
 
 # Get leaderboard
+LEADERBOARD_MIN_FIGHTS = 5  # Minimum fights to qualify
+LEADERBOARD_MAX_LIMIT = 100
+
+# Win rate, then total wins; user id breaks ties so ranks are stable
+LEADERBOARD_ORDER = (FighterStats.win_rate.desc(), FighterStats.wins.desc(), FighterStats.user_id.desc())
+
+
+def leaderboard_query(db: Session, style: Optional[str] = None):
+    """Qualifying fighters, optionally limited to one martial art, served from the ranking index"""
+    query = db.query(FighterStats).filter(FighterStats.total_fights >= LEADERBOARD_MIN_FIGHTS)
+
+    if style:
+        query = query.join(UserStyle, and_(
+            UserStyle.user_id == FighterStats.user_id,
+            UserStyle.style == style
+        ))
+
+    return query
+
+
 @app.get("/leaderboard")
 def get_leaderboard(
         style: str = None,
         limit: int = 10,
+        offset: int = 0,
         db: Session = Depends(get_db)
 ):
     """Get top fighters leaderboard"""
+    limit = max(1, min(limit, LEADERBOARD_MAX_LIMIT))
+    offset = max(offset, 0)
 
-    users = db.query(User).all()
+    rows = leaderboard_query(db, style).add_entity(User).join(
+        User, User.id == FighterStats.user_id
+    ).order_by(*LEADERBOARD_ORDER).offset(offset).limit(limit).all()
 
     leaderboard = []
 
-    for user in users:
-        total_fights = user.wins + user.losses + user.draws
-
-        if total_fights < 5:  # Minimum fights to qualify
-            continue
-
-        win_rate = (user.wins / total_fights * 100) if total_fights > 0 else 0
-
-        # Filter by style if specified
-        if style:
-            martial_arts = json.loads(user.martial_arts) if user.martial_arts else []
-            if style not in martial_arts:
-                continue
-
+    for rank, (stats, user) in enumerate(rows, start=offset + 1):
         leaderboard.append({
+            "rank": rank,
             "user_id": user.id,
             "username": user.username,
             "wins": user.wins,
             "losses": user.losses,
             "draws": user.draws,
-            "total_fights": total_fights,
-            "win_rate": round(win_rate, 1),
+            "total_fights": stats.total_fights,
+            "win_rate": round(stats.win_rate, 1),
             "skill_level": user.skill_level
         })
 
-    # Sort by win rate, then total wins
-    leaderboard.sort(key=lambda x: (x["win_rate"], x["wins"]), reverse=True)
+    return leaderboard
+
+
+@app.get("/leaderboard/me")
+def get_my_leaderboard_rank(
+        style: str = None,
+        current_user: User = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    """Get the current user's leaderboard rank (null until they have enough fights)"""
+    stats = get_fighter_stats(current_user.id, db)
+
+    qualifies = stats.total_fights >= LEADERBOARD_MIN_FIGHTS
+    if qualifies and style:
+        qualifies = db.get(UserStyle, (current_user.id, style)) is not None
+
+    rank = None
+    if qualifies:
+        ranked_ahead = leaderboard_query(db, style).filter(or_(
+            FighterStats.win_rate > stats.win_rate,
+            and_(FighterStats.win_rate == stats.win_rate, FighterStats.wins > stats.wins),
+            and_(FighterStats.win_rate == stats.win_rate, FighterStats.wins == stats.wins,
+                 FighterStats.user_id > stats.user_id)
+        )).count()
+        rank = ranked_ahead + 1
 
-    return leaderboard[:limit]
+    return {
+        "user_id": current_user.id,
+        "rank": rank,
+        "total_fights": stats.total_fights,
+        "win_rate": round(stats.win_rate, 1),
+        "min_fights": LEADERBOARD_MIN_FIGHTS
+    }
 
 
 @app.get("/achievements/progress")
@@ -1796,59 +3467,14 @@ def get_achievements_progress(
 
     user = db.query(User).filter(User.id == current_user.id).first()
 
-    # Get stats - handle both list and string types for martial_arts
-    if isinstance(user.martial_arts, list):
-        martial_arts = user.martial_arts
-    elif isinstance(user.martial_arts, str):
-        try:
-            martial_arts = json.loads(user.martial_arts)
-        except:
-            martial_arts = []
-    else:
-        martial_arts = []
+    martial_arts = get_martial_arts_list(user)
 
     total_fights = user.wins + user.losses + user.draws
 
-    # Calculate streaks
-    fights = db.query(FightRecord).filter(
-        (FightRecord.user_id == user.id) | (FightRecord.opponent_id == user.id)
-    ).order_by(FightRecord.date.desc()).all()
-
-    current_streak = 0
-    longest_streak = 0
-    temp_streak = 0
-
-    for fight in fights:
-        is_winner = (fight.user_id == user.id and fight.result == "win") or \
-                    (fight.opponent_id == user.id and fight.result == "loss")
-
-        if is_winner:
-            temp_streak += 1
-            longest_streak = max(longest_streak, temp_streak)
-        else:
-            temp_streak = 0
-
-    # Current streak
-    for fight in fights:
-        is_winner = (fight.user_id == user.id and fight.result == "win") or \
-                    (fight.opponent_id == user.id and fight.result == "loss")
-
-        if is_winner:
-            current_streak += 1
-        else:
-            break
-
-    # Training streak
-    training_days = set()
-    for fight in fights:
-        training_days.add(fight.date.date())
-
-    training_streak = 0
-    check_date = datetime.utcnow().date()
-
-    while check_date in training_days:
-        training_streak += 1
-        check_date -= timedelta(days=1)
+    streaks = get_streaks(get_fighter_stats(user.id, db))
+    current_streak = streaks["current_streak"]
+    longest_streak = streaks["longest_streak"]
+    training_streak = streaks["training_streak"]
 
     win_rate = (user.wins / total_fights * 100) if total_fights > 0 else 0
 
@@ -1992,6 +3618,82 @@ def get_achievements_progress(
     }
 
 
+PHOTO_ALLOWED_TYPES = ["image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp"]
+PHOTO_MAX_BYTES = 5 * 1024 * 1024
+# Chunk size for reading uploads and for resumable uploads to Storage (must be a multiple of 256KB)
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+# Room for the multipart boundaries and part headers around the photo itself
+PHOTO_UPLOAD_OVERHEAD_BYTES = 64 * 1024
+PHOTO_UPLOAD_PATHS = {"/users/me/photo", "/users/me/gallery"}
+
+
+class PhotoUploadLimitMiddleware:
+    """Stop oversized photo uploads before Starlette spools the request body.
+
+    A request whose Content-Length is over the limit is rejected before any of the body
+    is read, and a body sent without one is cut off as soon as it passes the limit.
+    Raising from receive lets FastAPI's exception handling (and CORS) answer as usual.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in PHOTO_UPLOAD_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        limit = PHOTO_MAX_BYTES + PHOTO_UPLOAD_OVERHEAD_BYTES
+        content_length = Headers(scope=scope).get("content-length", "")
+        declared_too_large = content_length.isdigit() and int(content_length) > limit
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            if declared_too_large:
+                raise HTTPException(status_code=400, detail="File size must be less than 5MB")
+
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=400, detail="File size must be less than 5MB")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+app.add_middleware(PhotoUploadLimitMiddleware)
+
+
+async def validate_photo_upload(file: UploadFile):
+    """Reject uploads with the wrong type or over the size limit without reading them into memory.
+
+    PhotoUploadLimitMiddleware has already refused request bodies well over the limit; this
+    checks the exact size of the spooled part, scanning it chunk by chunk if it isn't known.
+    """
+    if file.content_type not in PHOTO_ALLOWED_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Only JPEG, PNG, GIF, and WebP are allowed."
+        )
+
+    size = file.size
+    if size is None:
+        size = 0
+        while size <= PHOTO_MAX_BYTES:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+        await file.seek(0)
+
+    if size > PHOTO_MAX_BYTES:
+        raise HTTPException(status_code=400, detail="File size must be less than 5MB")
+
+
 @app.post("/users/me/photo")
 async def upload_profile_photo(
         file: UploadFile = File(...),
@@ -2000,49 +3702,109 @@ async def upload_profile_photo(
 ):
     """Upload a profile photo to Firebase Storage"""
 
-    # Validate file type
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(
-            status_code=400,
-            detail="Invalid file type. Only JPEG, PNG, GIF, and WebP are allowed."
-        )
-
-    # Validate file size (max 5MB)
-    temp_file = await file.read()
-    file_size = len(temp_file)
+    await validate_photo_upload(file)
 
-    if file_size > 5 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File size must be less than 5MB")
+    # Storage and database calls block, so they run on the worker pool
+    return await run_in_threadpool(
+        save_profile_photo, file.file, file.filename, file.content_type, current_user, db
+    )
 
-    # Generate unique filename
-    file_extension = file.filename.split(".")[-1]
-    unique_filename = f"profile_photos/user_{current_user.id}_{uuid.uuid4()}.{file_extension}"
 
-    # Upload to Firebase Storage
-    blob = firebase_bucket.blob(unique_filename)
-    blob.upload_from_string(temp_file, content_type=file.content_type)
+def upload_photo_to_storage(fileobj, path: str, content_type: str) -> str:
+    """Stream a photo to Firebase Storage as a chunked resumable upload, make it public and return its URL (blocking)"""
+    fileobj.seek(0)
+    blob = firebase_bucket.blob(path)
+    with blob.open("wb", chunk_size=UPLOAD_CHUNK_BYTES, content_type=content_type) as writer:
+        shutil.copyfileobj(fileobj, writer, UPLOAD_CHUNK_BYTES)
 
     # Make it publicly accessible
     blob.make_public()
 
-    # Get public URL
-    photo_url = blob.public_url
+    return blob.public_url
+
+
+PHOTO_WORKERS = int(os.getenv("PHOTO_WORKERS", str(min(os.cpu_count() or 1, 4))))
+photo_executor = None
+photo_executor_lock = threading.Lock()
+
+
+def get_photo_executor() -> ProcessPoolExecutor:
+    """Process pool that encodes photo variants, so resizing doesn't hold the GIL for request threads.
+
+    Created on first use with spawned workers, which don't inherit the database or Firebase
+    connections of this process. Under `uvicorn main:app` (render.yaml) they only import
+    photo_variants; under `python main.py` they also re-run this file, see IS_PHOTO_WORKER.
+    """
+    global photo_executor
+    with photo_executor_lock:
+        if photo_executor is None:
+            photo_executor = ProcessPoolExecutor(
+                max_workers=PHOTO_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return photo_executor
+
+
+@app.on_event("shutdown")
+def shutdown_photo_executor():
+    if photo_executor is not None:
+        photo_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def render_photo_upload(fileobj) -> dict:
+    """Resize an uploaded photo in the process pool, returning {variant name: WebP bytes} (blocking)
+
+    The upload is copied chunk by chunk to a named temporary file that the worker opens
+    itself, so neither process holds the whole upload in memory.
+    """
+    fileobj.seek(0)
+    # Closed before the worker opens it, since Windows won't open a file twice
+    with tempfile.NamedTemporaryFile(delete=False) as spooled:
+        shutil.copyfileobj(fileobj, spooled, UPLOAD_CHUNK_BYTES)
+    try:
+        return get_photo_executor().submit(render_photo_variants, spooled.name).result()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid image file")
+    finally:
+        os.remove(spooled.name)
+
+
+def upload_photo_variants(variants: dict, path_prefix: str) -> dict:
+    """Upload rendered variants next to the original, returning {"<variant>_url": url} (blocking)"""
+    return {
+        f"{name}_url": upload_photo_to_storage(BytesIO(data), f"{path_prefix}_{name}.webp", PHOTO_VARIANT_CONTENT_TYPE)
+        for name, data in variants.items()
+    }
+
+
+def save_profile_photo(fileobj, filename: str, content_type: str, current_user: User, db: Session):
+    # Resize first so broken images are rejected before anything is uploaded
+    variants = render_photo_upload(fileobj)
+
+    # Generate unique filename
+    file_extension = filename.split(".")[-1]
+    path_prefix = f"profile_photos/user_{current_user.id}_{uuid.uuid4()}"
+    unique_filename = f"{path_prefix}.{file_extension}"
+
+    # Upload to Firebase Storage
+    upload_photo_to_storage(fileobj, unique_filename, content_type)
+    variant_urls = upload_photo_variants(variants, path_prefix)
 
     # Update user profile in database
-    current_user.profile_pic = photo_url
+    current_user.profile_pic = variant_urls["card_url"]
     db.commit()
     db.refresh(current_user)
 
     return {
         "message": "Profile photo uploaded successfully",
-        "photo_url": current_user.profile_pic
+        "photo_url": current_user.profile_pic,
+        **variant_urls
     }
 
 
 # Add endpoint to delete profile photo
 @app.delete("/users/me/photo")
-async def delete_profile_photo(
+def delete_profile_photo(
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
@@ -2067,7 +3829,7 @@ async def delete_profile_photo(
 
 # Update the /users/{user_id} endpoint to get user info (if it doesn't exist)
 @app.get("/users/{user_id}")
-async def get_user_by_id(
+def get_user_by_id(
         user_id: int,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
@@ -2105,21 +3867,16 @@ async def upload_gallery_photo(
 ):
     """Upload a photo to user's gallery (Firebase Storage)"""
 
-    # Validate file type
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(
-            status_code=400,
-            detail="Invalid file type. Only JPEG, PNG, GIF, and WebP are allowed."
-        )
+    await validate_photo_upload(file)
 
-    # Validate file size (max 5MB)
-    temp_file = await file.read()
-    file_size = len(temp_file)
+    # Storage and database calls block, so they run on the worker pool
+    return await run_in_threadpool(
+        save_gallery_photo, file.file, file.filename, file.content_type, is_primary, current_user, db
+    )
 
-    if file_size > 5 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File size must be less than 5MB")
 
+def save_gallery_photo(fileobj, filename: str, content_type: str, is_primary: bool,
+                       current_user: User, db: Session):
     # Check photo limit (max 6 photos)
     existing_photos = db.query(PhotoGallery).filter(
         PhotoGallery.user_id == current_user.id
@@ -2128,16 +3885,17 @@ async def upload_gallery_photo(
     if existing_photos >= 6:
         raise HTTPException(status_code=400, detail="Maximum 6 photos allowed")
 
+    # Resize first so broken images are rejected before anything is uploaded
+    variants = render_photo_upload(fileobj)
+
     # Generate unique filename
-    file_extension = file.filename.split(".")[-1]
-    unique_filename = f"gallery_photos/user_{current_user.id}_{uuid.uuid4()}.{file_extension}"
+    file_extension = filename.split(".")[-1]
+    path_prefix = f"gallery_photos/user_{current_user.id}_{uuid.uuid4()}"
+    unique_filename = f"{path_prefix}.{file_extension}"
 
     # Upload to Firebase Storage
-    blob = firebase_bucket.blob(unique_filename)
-    blob.upload_from_string(temp_file, content_type=file.content_type)
-    blob.make_public()
-
-    photo_url = blob.public_url
+    photo_url = upload_photo_to_storage(fileobj, unique_filename, content_type)
+    variant_urls = upload_photo_variants(variants, path_prefix)
 
     # If this is set as primary, unset other primary photos
     if is_primary:
@@ -2147,7 +3905,7 @@ async def upload_gallery_photo(
         ).update({"is_primary": False})
 
         # Also update profile_pic
-        current_user.profile_pic = photo_url
+        current_user.profile_pic = variant_urls["card_url"]
 
     # Get next order index
     max_order = db.query(func.max(PhotoGallery.order_index)).filter(
@@ -2158,6 +3916,7 @@ async def upload_gallery_photo(
     new_photo = PhotoGallery(
         user_id=current_user.id,
         photo_url=photo_url,
+        **variant_urls,
         is_primary=is_primary,
         order_index=max_order + 1
     )
@@ -2171,6 +3930,9 @@ async def upload_gallery_photo(
         "photo": {
             "id": new_photo.id,
             "photo_url": new_photo.photo_url,
+            "thumbnail_url": new_photo.thumbnail_url,
+            "card_url": new_photo.card_url,
+            "full_url": new_photo.full_url,
             "is_primary": new_photo.is_primary,
             "order_index": new_photo.order_index
         }
@@ -2178,7 +3940,7 @@ async def upload_gallery_photo(
 
 # Get user's gallery
 @app.get("/users/me/gallery")
-async def get_my_gallery(
+def get_my_gallery(
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
@@ -2193,7 +3955,7 @@ async def get_my_gallery(
 
 # Get another user's gallery
 @app.get("/users/{user_id}/gallery")
-async def get_user_gallery(
+def get_user_gallery(
         user_id: int,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
@@ -2213,28 +3975,30 @@ class MessageCreate(BaseModel):
 
 
 @app.post("/messages/send")
-async def send_message(
+def send_message(
         message_data: MessageCreate,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
     """Send a real-time message via Firebase"""
 
-    # Verify users are matched - FIX THIS PART
-    match = db.query(User).filter(User.id == message_data.match_id).first()
+    # Verify users are matched
+    if not is_matched(current_user.id, message_data.match_id, db):
+        raise HTTPException(status_code=403, detail="Not matched with this user")
 
+    match = db.get(User, message_data.match_id)
     if not match:
         raise HTTPException(status_code=404, detail="User not found")
 
-    if match not in current_user.matches:
-        raise HTTPException(status_code=403, detail="Not matched with this user")
-
     # Create conversation ID (sorted user IDs for consistency)
     conversation_id = f"chat_{min(current_user.id, message_data.match_id)}_{max(current_user.id, message_data.match_id)}"
 
+    # Message, conversation metadata and both inbox entries are written in one batch
+    batch = firebase_db.batch()
+
     # Add message to Firestore
     message_ref = firebase_db.collection('conversations').document(conversation_id).collection('messages').document()
-    message_ref.set({
+    batch.set(message_ref, {
         'sender_id': current_user.id,
         'sender_name': current_user.username,
         'content': message_data.content,
@@ -2243,72 +4007,239 @@ async def send_message(
     })
 
     # Update conversation metadata
-    firebase_db.collection('conversations').document(conversation_id).set({
+    batch.set(firebase_db.collection('conversations').document(conversation_id), {
         'participants': [current_user.id, message_data.match_id],
         'last_message': message_data.content,
         'last_message_timestamp': firestore.SERVER_TIMESTAMP,
         'last_sender_id': current_user.id
     }, merge=True)
 
+    last_message = {
+        'conversation_id': conversation_id,
+        'last_message': message_data.content,
+        'last_message_timestamp': firestore.SERVER_TIMESTAMP,
+        'last_sender_id': current_user.id
+    }
+    batch.set(inbox_entry_ref(current_user.id, conversation_id), {
+        **last_message, **inbox_participant_fields(match)
+    }, merge=True)
+    batch.set(inbox_entry_ref(message_data.match_id, conversation_id), {
+        **last_message, **inbox_participant_fields(current_user),
+        'unread_count': firestore.Increment(1)
+    }, merge=True)
+
+    batch.commit()
+
+    event_data = {
+        'id': message_ref.id,
+        'conversation_id': conversation_id,
+        'sender_id': current_user.id,
+        'sender_name': current_user.username,
+        'content': message_data.content,
+        'timestamp': datetime.utcnow().isoformat()
+    }
+    event_broker.publish(message_data.match_id, "message", event_data)
+    # The sender's other open clients see it too
+    event_broker.publish(current_user.id, "message", event_data)
+
     return {"status": "sent", "conversation_id": conversation_id}
 
 
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 100
+
+
+def message_to_dict(msg) -> dict:
+    msg_data = msg.to_dict()
+    return {
+        'id': msg.id,
+        'sender_id': msg_data.get('sender_id'),
+        'sender_name': msg_data.get('sender_name'),
+        'content': msg_data.get('content'),
+        'timestamp': msg_data.get('timestamp'),
+        'read': msg_data.get('read', False)
+    }
+
+
 @app.get("/messages/{match_id}")
-async def get_messages(
+def get_messages(
         match_id: int,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        since: Optional[datetime] = None,
+        limit: int = MESSAGES_PAGE_SIZE,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
-    """Get message history with a match"""
+    """Get message history with a match, oldest first.
+
+    Without a cursor the newest `limit` messages are returned. Pass the id of the
+    first message as `before` to page back through older history, the id of the
+    last message as `after` to fetch newer ones, or a timestamp as `since` to
+    only get messages sent after it. `has_more` says whether another page exists
+    in the same direction.
+    """
+
+    if sum(value is not None for value in (before, after, since)) > 1:
+        raise HTTPException(status_code=400, detail="Use only one of before, after or since")
+    limit = max(1, min(limit, MESSAGES_MAX_PAGE_SIZE))
 
     # Verify users are matched
-    match = db.query(User).filter(User.id == match_id).first()
-    if not match or match not in current_user.matches:
+    if not is_matched(current_user.id, match_id, db):
         raise HTTPException(status_code=403, detail="Not matched with this user")
 
     # Create conversation ID
     conversation_id = f"chat_{min(current_user.id, match_id)}_{max(current_user.id, match_id)}"
 
     # Get messages from Firestore
-    messages_ref = firebase_db.collection('conversations').document(conversation_id).collection('messages')
-    messages = messages_ref.order_by('timestamp').limit(100).stream()
+    conversation_ref = firebase_db.collection('conversations').document(conversation_id)
+    messages_ref = conversation_ref.collection('messages')
+
+    cursor_id = before or after
+    if cursor_id is not None:
+        cursor = messages_ref.document(cursor_id).get()
+        if not cursor.exists:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if after is not None:
+        query = messages_ref.order_by('timestamp').start_after(cursor)
+    elif since is not None:
+        query = messages_ref.where('timestamp', '>', since).order_by('timestamp')
+    else:
+        # Newest first, reversed below, so the page ends at the latest message
+        query = messages_ref.order_by('timestamp', direction=firestore.Query.DESCENDING)
+        if before is not None:
+            query = query.start_after(cursor)
+
+    # One extra message tells us whether there is another page
+    messages = list(query.limit(limit + 1).stream())
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if after is None and since is None:
+        messages.reverse()
+
+    # Messages at or before the recipient's read watermark are read even if their flag isn't set yet
+    conversation = conversation_ref.get(field_paths=['read_watermarks'])
+    watermarks = (conversation.to_dict() or {}).get('read_watermarks', {}) if conversation.exists else {}
 
     message_list = []
     for msg in messages:
-        msg_data = msg.to_dict()
-        message_list.append({
-            'id': msg.id,
-            'sender_id': msg_data.get('sender_id'),
-            'sender_name': msg_data.get('sender_name'),
-            'content': msg_data.get('content'),
-            'timestamp': msg_data.get('timestamp'),
-            'read': msg_data.get('read', False)
-        })
+        message = message_to_dict(msg)
+        recipient_id = match_id if message['sender_id'] == current_user.id else current_user.id
+        watermark = watermarks.get(str(recipient_id))
+        if watermark and message['timestamp'] and message['timestamp'] <= watermark:
+            message['read'] = True
+        message_list.append(message)
+
+    return {"conversation_id": conversation_id, "messages": message_list, "has_more": has_more}
+
+
+CONVERSATIONS_PAGE_SIZE = 20
+CONVERSATIONS_MAX_PAGE_SIZE = 100
+
+
+def inbox_entry_ref(user_id: int, conversation_id: str):
+    """A user's inbox entry for a conversation: inboxes/{user_id}/conversations/{conversation_id}"""
+    return firebase_db.collection('inboxes').document(str(user_id)).collection('conversations').document(conversation_id)
+
+
+def inbox_participant_fields(other_user: User) -> dict:
+    """Display fields of the other participant, copied into the inbox entry so listing needs no lookups"""
+    return {
+        'other_user_id': other_user.id,
+        'other_username': other_user.username,
+        'other_full_name': other_user.full_name,
+        'other_profile_pic': other_user.profile_pic
+    }
+
+
+# The copies are refreshed whenever a committed change touches one of these columns
+INBOX_PARTICIPANT_COLUMNS = ("username", "full_name", "profile_pic")
+# One thread, so a user's successive changes reach the inboxes in order
+inbox_refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inbox-refresh")
+
+
+def refresh_inbox_participant(fields: dict):
+    """Copy a user's new display fields into the other participant's entry of each of their conversations (blocking)"""
+    user_id = fields['other_user_id']
+    try:
+        own_entries = firebase_db.collection('inboxes').document(str(user_id)).collection('conversations') \
+            .select(['other_user_id']).stream()
+        refs = [
+            inbox_entry_ref(other_user_id, entry.id)
+            for entry in own_entries
+            if (other_user_id := (entry.to_dict() or {}).get('other_user_id')) is not None
+        ]
+        update_documents_in_chunks(refs, fields)
+    except Exception as e:
+        print(f"Error refreshing inbox entries for user {user_id}: {e}")
+
+
+@event.listens_for(SessionLocal, "before_flush")
+def collect_inbox_participant_changes(session, flush_context, instances):
+    for obj in session.dirty:
+        if isinstance(obj, User) and any(
+                inspect(obj).attrs[column].history.has_changes() for column in INBOX_PARTICIPANT_COLUMNS
+        ):
+            session.info.setdefault("inbox_participant_changes", {})[obj.id] = inbox_participant_fields(obj)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def refresh_changed_inbox_participants(session):
+    for fields in session.info.pop("inbox_participant_changes", {}).values():
+        inbox_refresh_executor.submit(refresh_inbox_participant, fields)
+
 
-    return {"conversation_id": conversation_id, "messages": message_list}
+@event.listens_for(SessionLocal, "after_rollback")
+def forget_inbox_participant_changes(session):
+    session.info.pop("inbox_participant_changes", None)
 
 
 @app.get("/conversations")
-async def get_conversations(
+def get_conversations(
+        response: Response,
+        limit: int = CONVERSATIONS_PAGE_SIZE,
+        cursor: Optional[str] = None,
         current_user: User = Depends(get_current_user)
 ):
-    """Get all conversations for current user"""
+    """Get the current user's conversations, most recent first.
 
-    conversations_ref = firebase_db.collection('conversations')
-    conversations = conversations_ref.where('participants', 'array_contains', current_user.id).stream()
+    Served from the user's inbox, which send_message and mark_messages_read keep up
+    to date. A cursor for the next page is returned in the X-Next-Cursor header.
+    """
+    limit = max(1, min(limit, CONVERSATIONS_MAX_PAGE_SIZE))
+
+    inbox_ref = firebase_db.collection('inboxes').document(str(current_user.id)).collection('conversations')
+    query = inbox_ref.order_by('last_message_timestamp', direction=firestore.Query.DESCENDING)
+
+    if cursor:
+        after = inbox_ref.document(str(decode_cursor(cursor).get("id"))).get()
+        if not after.exists:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.start_after(after)
+
+    # One extra entry tells us whether there is another page
+    conversations = list(query.limit(limit + 1).stream())
+    if len(conversations) > limit:
+        conversations = conversations[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor({"id": conversations[-1].id})
 
     conv_list = []
     for conv in conversations:
         conv_data = conv.to_dict()
-        # Get the other participant ID
-        other_user_id = [uid for uid in conv_data.get('participants', []) if uid != current_user.id][0]
+        unread_count = conv_data.get('unread_count', 0)
 
         conv_list.append({
             'conversation_id': conv.id,
-            'other_user_id': other_user_id,
+            'other_user_id': conv_data.get('other_user_id'),
+            'other_username': conv_data.get('other_username'),
+            'other_full_name': conv_data.get('other_full_name'),
+            'other_profile_pic': conv_data.get('other_profile_pic'),
             'last_message': conv_data.get('last_message'),
             'last_message_timestamp': conv_data.get('last_message_timestamp'),
-            'unread': conv_data.get('last_sender_id') != current_user.id
+            'last_sender_id': conv_data.get('last_sender_id'),
+            'unread_count': unread_count,
+            'unread': unread_count > 0
         })
 
     return conv_list
@@ -2316,7 +4247,7 @@ async def get_conversations(
 
 # Delete photo from gallery
 @app.delete("/users/me/gallery/{photo_id}")
-async def delete_gallery_photo(
+def delete_gallery_photo(
         photo_id: int,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
@@ -2348,7 +4279,7 @@ async def delete_gallery_photo(
 
 ## Set photo as primary
 @app.put("/users/me/gallery/{photo_id}/primary")
-async def set_primary_photo(
+def set_primary_photo(
     photo_id: int,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -2371,7 +4302,7 @@ async def set_primary_photo(
 
     # Set this photo as primary
     photo.is_primary = True
-    current_user.profile_pic = photo.photo_url
+    current_user.profile_pic = photo.card_url or photo.photo_url
 
     db.commit()
 
@@ -2379,7 +4310,7 @@ async def set_primary_photo(
 
 
 @app.get("/matches/unread")
-async def get_unread_matches(
+def get_unread_matches(
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
@@ -2387,7 +4318,7 @@ async def get_unread_matches(
 
     if not current_user.last_viewed_matches:
         # Never viewed, count all matches
-        return {"count": len(current_user.matches)}
+        return {"count": len(get_match_ids(current_user.id, db))}
 
     # Count matches created after last view
     recent_matches = db.query(matches_table).filter(
@@ -2399,7 +4330,7 @@ async def get_unread_matches(
 
 
 @app.post("/matches/mark-read")
-async def mark_matches_read(
+def mark_matches_read(
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
@@ -2409,35 +4340,78 @@ async def mark_matches_read(
     return {"status": "success"}
 
 
+# Batched Firestore commits run concurrently on their own small pool
+FIRESTORE_COMMIT_WORKERS = int(os.getenv("FIRESTORE_COMMIT_WORKERS", "4"))
+firestore_commit_executor = ThreadPoolExecutor(max_workers=FIRESTORE_COMMIT_WORKERS, thread_name_prefix="firestore-commit")
+
+
+def update_documents_in_chunks(refs: list, data: dict) -> int:
+    """Apply the same update to many documents in batches of FIRESTORE_BATCH_LIMIT, committed concurrently (blocking)"""
+    def commit_chunk(chunk):
+        batch = firebase_db.batch()
+        for ref in chunk:
+            batch.update(ref, data)
+        batch.commit()
+
+    chunks = [refs[i:i + FIRESTORE_BATCH_LIMIT] for i in range(0, len(refs), FIRESTORE_BATCH_LIMIT)]
+    # list() waits for every chunk and re-raises the first failure
+    list(firestore_commit_executor.map(commit_chunk, chunks))
+    return len(refs)
+
+
+def flag_messages_read(conversation_id: str, sender_id: int, watermark: datetime):
+    """Set the read flag on messages from sender_id sent up to the reader's watermark.
+
+    Runs after the response: the read watermark already makes them count as read,
+    the flags are kept for clients that read messages straight from Firestore.
+    Messages that arrived after the watermark are left unread.
+    """
+    messages_ref = firebase_db.collection('conversations').document(conversation_id).collection('messages')
+    # Equality filters only, which Firestore serves from its single-field indexes; a range
+    # on timestamp would need a composite index, so the watermark is checked here instead
+    unread_messages = messages_ref.where('sender_id', '==', sender_id).where('read', '==', False) \
+        .select(['timestamp']).stream()
+    try:
+        update_documents_in_chunks([
+            msg.reference for msg in unread_messages
+            if (timestamp := (msg.to_dict() or {}).get('timestamp')) is not None and timestamp <= watermark
+        ], {'read': True})
+    except Exception as e:
+        print(f"Error flagging messages read in {conversation_id}: {e}")
+
+
 @app.post("/messages/{match_id}/mark-read")
-async def mark_messages_read(
+def mark_messages_read(
         match_id: int,
+        background_tasks: BackgroundTasks,
         current_user: User = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
-    """Mark all messages from a match as read"""
+    """Mark all messages from a match as read.
+
+    Moves the reader's watermark on the conversation to now and clears the inbox
+    unread count (two writes, whatever the number of unread messages); the
+    per-message read flags are updated in the background.
+    """
     try:
         # Create conversation ID
         user_ids = sorted([current_user.id, match_id])
         conversation_id = f"chat_{user_ids[0]}_{user_ids[1]}"
 
-        # Get Firestore reference
-        firestore_db = firestore.client()
-        messages_ref = firestore_db.collection('conversations').document(conversation_id).collection('messages')
+        batch = firebase_db.batch()
+        batch.set(firebase_db.collection('conversations').document(conversation_id), {
+            'read_watermarks': {str(current_user.id): firestore.SERVER_TIMESTAMP}
+        }, merge=True)
 
-        # Query for unread messages from the other user
-        unread_messages = messages_ref.where('sender_id', '!=', current_user.id).where('read', '==', False).stream()
+        # Reset the unread counter in the reader's inbox
+        batch.set(inbox_entry_ref(current_user.id, conversation_id), {'unread_count': 0}, merge=True)
 
-        # Mark all as read
-        batch = firestore_db.batch()
-        count = 0
-        for msg in unread_messages:
-            batch.update(msg.reference, {'read': True})
-            count += 1
+        # The server timestamp resolves to the commit time, so this is the stored watermark
+        watermark = batch.commit()[0].update_time
 
-        batch.commit()
+        background_tasks.add_task(flag_messages_read, conversation_id, match_id, watermark)
 
-        return {"message": f"Marked {count} messages as read"}
+        return {"message": "Messages marked as read"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
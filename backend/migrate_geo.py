@@ -0,0 +1,37 @@
+# backend/migrate_geo.py
+"""
+Run this script to add the geo_cell spatial index column to the users table
+and backfill it for users that already shared their location
+"""
+from sqlalchemy import inspect, text
+from main import engine, SessionLocal, User, geo_cell_for
+
+
+def migrate():
+    print("Adding geo_cell column to users table...")
+    columns = {column["name"] for column in inspect(engine).get_columns("users")}
+
+    with engine.connect() as conn:
+        if "geo_cell" not in columns:
+            conn.execute(text("ALTER TABLE users ADD COLUMN geo_cell INTEGER"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_geo_cell ON users (geo_cell)"))
+        conn.commit()
+    print("✅ Column and index ready")
+
+    print("Backfilling geo cells...")
+    db = SessionLocal()
+    try:
+        users = db.query(User).filter(
+            User.latitude.isnot(None),
+            User.longitude.isnot(None)
+        ).all()
+        for user in users:
+            user.geo_cell = geo_cell_for(user.latitude, user.longitude)
+        db.commit()
+        print(f"✅ Migration complete! Updated {len(users)} users.")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,57 @@
+# backend/migrate_inboxes.py
+"""
+Run this script to build the per-user conversation inboxes
+(inboxes/{user_id}/conversations/{conversation_id}) from existing conversations.
+New messages keep the inboxes up to date, so this only needs to run once.
+"""
+from main import SessionLocal, User, firebase_db, FIRESTORE_BATCH_LIMIT, inbox_entry_ref, inbox_participant_fields
+
+
+def migrate():
+    print("Building conversation inboxes...")
+    db = SessionLocal()
+    try:
+        batch = firebase_db.batch()
+        pending = 0
+        built = 0
+
+        for conv in firebase_db.collection('conversations').stream():
+            conv_data = conv.to_dict()
+            participants = conv_data.get('participants', [])
+            if len(participants) != 2:
+                continue
+
+            users = {user.id: user for user in db.query(User).filter(User.id.in_(participants)).all()}
+            messages_ref = conv.reference.collection('messages')
+
+            for user_id in participants:
+                other_id = next(uid for uid in participants if uid != user_id)
+                if user_id not in users or other_id not in users:
+                    continue
+
+                unread = messages_ref.where('sender_id', '==', other_id).where('read', '==', False).count().get()
+                batch.set(inbox_entry_ref(user_id, conv.id), {
+                    'conversation_id': conv.id,
+                    **inbox_participant_fields(users[other_id]),
+                    'last_message': conv_data.get('last_message'),
+                    'last_message_timestamp': conv_data.get('last_message_timestamp'),
+                    'last_sender_id': conv_data.get('last_sender_id'),
+                    'unread_count': unread[0][0].value
+                }, merge=True)
+                pending += 1
+                built += 1
+
+                if pending == FIRESTORE_BATCH_LIMIT:
+                    batch.commit()
+                    batch = firebase_db.batch()
+                    pending = 0
+
+        if pending:
+            batch.commit()
+        print(f"✅ Migration complete! Built {built} inbox entries.")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    migrate()
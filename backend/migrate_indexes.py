@@ -0,0 +1,40 @@
+# backend/migrate_indexes.py
+"""
+Run this script to create the composite indexes and unique constraints
+declared on the models on an existing database. Duplicate swipes are
+removed first so the unique (user_id, target_user_id) index can be built.
+"""
+from sqlalchemy import inspect, text
+from main import engine, Base
+
+
+def migrate():
+    print("Removing duplicate swipes...")
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            DELETE FROM swipes
+            WHERE id NOT IN (
+                SELECT MIN(id) FROM swipes GROUP BY user_id, target_user_id
+            )
+        """))
+        conn.commit()
+    print(f"✅ Removed {result.rowcount} duplicate swipes")
+
+    print("Creating indexes...")
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            missing = [column.name for column in index.columns if column.name not in columns]
+            if missing:
+                # Added by a later migration (e.g. users.geo_cell by migrate_geo.py), which creates the index itself
+                print(f"  ⚠️  {index.name} skipped, {table.name} has no {', '.join(missing)} column yet")
+                continue
+            index.create(bind=engine, checkfirst=True)
+            print(f"  {index.name}")
+    print("✅ Migration complete!")
+
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,41 @@
+# backend/migrate_leaderboard.py
+"""
+Run this script to add the leaderboard ranking columns to fighter_stats and
+rebuild every user's stats row from their fight history
+"""
+from sqlalchemy import inspect, text
+from main import engine, Base, SessionLocal, User, rebuild_fighter_stats
+
+
+def migrate():
+    print("Creating fighter_stats table...")
+    Base.metadata.create_all(bind=engine)
+
+    print("Adding ranking columns...")
+    columns = {column["name"] for column in inspect(engine).get_columns("fighter_stats")}
+    with engine.connect() as conn:
+        for name, column_type in [("wins", "INTEGER DEFAULT 0"),
+                                  ("total_fights", "INTEGER DEFAULT 0"),
+                                  ("win_rate", "FLOAT DEFAULT 0")]:
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE fighter_stats ADD COLUMN {name} {column_type}"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_fighter_stats_ranking ON fighter_stats (win_rate, wins, user_id)"
+        ))
+        conn.commit()
+    print("✅ Columns and index ready")
+
+    print("Rebuilding fighter stats...")
+    db = SessionLocal()
+    try:
+        user_ids = [user_id for (user_id,) in db.query(User.id).all()]
+        for user_id in user_ids:
+            rebuild_fighter_stats(user_id, db)
+        db.commit()
+        print(f"✅ Migration complete! Rebuilt stats for {len(user_ids)} users.")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,26 @@
+# backend/migrate_outbox.py
+"""
+Run this script to add the claim and dead-letter columns to the firestore_outbox table
+"""
+from sqlalchemy import inspect, text
+from main import engine, Base
+
+
+def migrate():
+    print("Creating firestore_outbox table...")
+    Base.metadata.create_all(bind=engine)
+
+    print("Adding claim and dead-letter columns...")
+    columns = {column["name"] for column in inspect(engine).get_columns("firestore_outbox")}
+    with engine.connect() as conn:
+        for name, column_type in [("claimed_by", "VARCHAR"),
+                                  ("claimed_until", "TIMESTAMP"),
+                                  ("dead_lettered_at", "TIMESTAMP")]:
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE firestore_outbox ADD COLUMN {name} {column_type}"))
+        conn.commit()
+    print("✅ Migration complete!")
+
+
+if __name__ == "__main__":
+    migrate()
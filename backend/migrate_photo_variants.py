@@ -0,0 +1,27 @@
+# backend/migrate_photo_variants.py
+"""
+Run this script to add the resized variant URL columns to the photo_gallery table.
+Photos uploaded before this migration keep only photo_url; clients fall back to it.
+"""
+from sqlalchemy import inspect, text
+from main import engine
+
+VARIANT_COLUMNS = ["thumbnail_url", "card_url", "full_url"]
+
+
+def migrate():
+    print("Adding photo variant columns to photo_gallery table...")
+    columns = {column["name"] for column in inspect(engine).get_columns("photo_gallery")}
+
+    with engine.connect() as conn:
+        for column in VARIANT_COLUMNS:
+            if column not in columns:
+                conn.execute(text(f"ALTER TABLE photo_gallery ADD COLUMN {column} VARCHAR"))
+                print(f"✅ Added {column}")
+        conn.commit()
+
+    print("✅ Migration complete!")
+
+
+if __name__ == "__main__":
+    migrate()
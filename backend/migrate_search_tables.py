@@ -0,0 +1,26 @@
+# backend/migrate_search_tables.py
+"""
+Run this script to create the user_styles / user_available_days lookup tables
+used by discover filtering and fill them from existing profiles
+"""
+from main import engine, Base, SessionLocal, User, sync_discover_search_rows
+
+
+def migrate():
+    print("Creating discover search tables...")
+    Base.metadata.create_all(bind=engine)
+
+    print("Backfilling styles and availability...")
+    db = SessionLocal()
+    try:
+        users = db.query(User).all()
+        for user in users:
+            sync_discover_search_rows(user)
+        db.commit()
+        print(f"✅ Migration complete! Indexed {len(users)} users.")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    migrate()
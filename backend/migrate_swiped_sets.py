@@ -0,0 +1,28 @@
+# backend/migrate_swiped_sets.py
+"""
+Run this script to create the swiped_sets table and build every user's swiped set
+from their swipe history. Sets are also built lazily on first use, so this only
+saves the first discover request of each user the work.
+"""
+from main import engine, Base, SessionLocal, User, rebuild_swiped_set
+
+
+def migrate():
+    print("Creating swiped_sets table...")
+    Base.metadata.create_all(bind=engine)
+    print("✅ Table ready")
+
+    print("Building swiped sets...")
+    db = SessionLocal()
+    try:
+        user_ids = [user_id for (user_id,) in db.query(User.id).all()]
+        for user_id in user_ids:
+            rebuild_swiped_set(user_id, db)
+        db.commit()
+        print(f"✅ Migration complete! Built swiped sets for {len(user_ids)} users.")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    migrate()
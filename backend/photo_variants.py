@@ -0,0 +1,48 @@
+# backend/photo_variants.py
+"""
+Resizing of uploaded photos into fixed-size WebP variants.
+
+This module only depends on Pillow so it can be imported cheaply by the
+worker processes that do the encoding, away from the request threads.
+"""
+from io import BytesIO
+from PIL import Image, ImageOps
+
+# Variant name -> longest edge in pixels
+PHOTO_VARIANTS = {
+    "thumbnail": 320,
+    "card": 720,
+    "full": 1280,
+}
+PHOTO_VARIANT_QUALITY = 80
+PHOTO_VARIANT_CONTENT_TYPE = "image/webp"
+
+# Refuse to decode images that would expand to more than ~50 megapixels
+Image.MAX_IMAGE_PIXELS = 50_000_000
+
+
+def render_photo_variants(path: str) -> dict:
+    """Decode the uploaded image at path and return {variant name: WebP bytes}.
+
+    Raises ValueError if the file is not an image Pillow can read.
+    """
+    try:
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            image.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Could not read image: {e}") from None
+
+    variants = {}
+    for name, size in PHOTO_VARIANTS.items():
+        variant = image.copy()
+        # Never upscale, only shrink to fit within size x size
+        variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+
+        output = BytesIO()
+        variant.save(output, format="WEBP", quality=PHOTO_VARIANT_QUALITY, method=4)
+        variants[name] = output.getvalue()
+
+    return variants
@@ -1,55 +1,156 @@
-from main import SessionLocal, User, firebase_db
+# backend/sync_column.py
+"""
+Bulk sync of the users table to Firestore.
+
+Users are streamed from the database in id-ordered chunks. Each chunk costs one
+batched get_all (to see which documents exist) and one batched write, and chunks
+run concurrently on a bounded worker pool. Progress is checkpointed after every
+completed chunk, so an interrupted run picks up where it stopped. The checkpoint
+is removed once a run completes, so the next run syncs every user again.
+
+    python sync_column.py                  # sync every user, or resume an interrupted run
+    python sync_column.py --restart        # sync everything again
+    python sync_column.py --workers 16 --chunk-size 250
+"""
+import argparse
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from firebase_admin import firestore
+from main import SessionLocal, User, firebase_db, FIRESTORE_BATCH_LIMIT
 
-db = SessionLocal()
 
-# Get all users
-users = db.query(User).all()
+def user_to_document(user: User) -> dict:
+    return {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'full_name': user.full_name,
+        'age': user.age,
+        'height': user.height,
+        'weight': user.weight,
+        'location': user.location,
+        'bio': user.bio,
+        'martial_arts': user.martial_arts,
+        'experience_years': user.experience_years,
+        'skill_level': user.skill_level,
+        'preferred_styles': user.preferred_styles,
+        'weight_class': user.weight_class,
+        'wins': user.wins,
+        'losses': user.losses,
+        'draws': user.draws,
+        'profile_pic': user.profile_pic,
+        'last_viewed_matches': user.last_viewed_matches,
+    }
 
-print(f"Found {len(users)} users to sync...")
 
-for user in users:
-    try:
-        # Check if user exists in Firebase
-        doc_ref = firebase_db.collection('users').document(str(user.id))
-        doc = doc_ref.get()
-
-        if doc.exists:
-            # Update with new column (replace 'your_column_name' with actual column)
-            doc_ref.update({
-                'last_viewed_matches': user.last_viewed_matches if hasattr(user, 'last_viewed_matches') else None,
-                # Add other columns here
+def sync_chunk(documents: list) -> tuple:
+    """Create missing user documents and update existing ones. Returns (created, updated)."""
+    refs = [firebase_db.collection('users').document(str(document['id'])) for document in documents]
+    existing = {snapshot.id for snapshot in firebase_db.get_all(refs, field_paths=['id']) if snapshot.exists}
+
+    batch = firebase_db.batch()
+    created = 0
+    for ref, document in zip(refs, documents):
+        if ref.id in existing:
+            # Update with new columns (add other columns here)
+            batch.set(ref, {
+                'last_viewed_matches': document['last_viewed_matches'],
                 'updated_at': firestore.SERVER_TIMESTAMP
-            })
-            print(f"✅ Updated user {user.id} ({user.username})")
+            }, merge=True)
         else:
-            # User doesn't exist in Firebase, create it
-            doc_ref.set({
-                'id': user.id,
-                'username': user.username,
-                'email': user.email,
-                'full_name': user.full_name,
-                'age': user.age,
-                'height': user.height,
-                'weight': user.weight,
-                'location': user.location,
-                'bio': user.bio,
-                'martial_arts': user.martial_arts,
-                'experience_years': user.experience_years,
-                'skill_level': user.skill_level,
-                'preferred_styles': user.preferred_styles,
-                'weight_class': user.weight_class,
-                'wins': user.wins,
-                'losses': user.losses,
-                'draws': user.draws,
-                'profile_pic': user.profile_pic,
-                'last_viewed_matches': user.last_viewed_matches if hasattr(user, 'last_viewed_matches') else None,
-                'created_at': firestore.SERVER_TIMESTAMP
-            })
-            print(f"✅ Created user {user.id} ({user.username}) in Firebase")
-
-    except Exception as e:
-        print(f"❌ Error with user {user.id}: {e}")
-
-print(f"\n✅ Sync complete! Processed {len(users)} users.")
-db.close()
\ No newline at end of file
+            batch.set(ref, {**document, 'created_at': firestore.SERVER_TIMESTAMP})
+            created += 1
+    batch.commit()
+
+    return created, len(documents) - created
+
+
+def read_chunks(after_id: int, chunk_size: int):
+    """Yield users as plain documents in id order, chunk_size at a time"""
+    db = SessionLocal()
+    try:
+        while True:
+            users = db.query(User).filter(User.id > after_id).order_by(User.id).limit(chunk_size).all()
+            if not users:
+                return
+            yield [user_to_document(user) for user in users]
+            after_id = users[-1].id
+            db.expunge_all()
+    finally:
+        db.close()
+
+
+def load_checkpoint(path: Path) -> int:
+    if path.exists():
+        return json.loads(path.read_text()).get('last_user_id', 0)
+    return 0
+
+
+def save_checkpoint(path: Path, last_user_id: int):
+    path.write_text(json.dumps({'last_user_id': last_user_id}))
+
+
+def clear_checkpoint(path: Path):
+    path.unlink(missing_ok=True)
+
+
+def sync(chunk_size: int, workers: int, checkpoint: Path, restart: bool):
+    start_after = 0 if restart else load_checkpoint(checkpoint)
+    if start_after:
+        print(f"Resuming after user {start_after}...")
+
+    started = time.monotonic()
+    synced = created = updated = 0
+    pending = deque()  # (last id in chunk, size, future) in id order
+
+    def finish_oldest():
+        """Wait for the oldest chunk; the checkpoint only advances past fully synced chunks"""
+        nonlocal synced, created, updated
+        last_id, size, future = pending.popleft()
+        try:
+            chunk_created, chunk_updated = future.result()
+        except Exception as e:
+            print(f"❌ Error syncing chunk ending at user {last_id}: {e}")
+            raise
+
+        synced += size
+        created += chunk_created
+        updated += chunk_updated
+        save_checkpoint(checkpoint, last_id)
+
+        elapsed = time.monotonic() - started
+        print(f"✅ {synced} users synced ({created} created, {updated} updated), "
+              f"{synced / elapsed:.0f} users/s")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for documents in read_chunks(start_after, chunk_size):
+            # Keep a bounded number of chunks in flight
+            while len(pending) >= workers * 2:
+                finish_oldest()
+            pending.append((documents[-1]['id'], len(documents), executor.submit(sync_chunk, documents)))
+
+        while pending:
+            finish_oldest()
+
+    # Only an interrupted run leaves a checkpoint behind to resume from
+    clear_checkpoint(checkpoint)
+
+    elapsed = time.monotonic() - started
+    print(f"\n✅ Sync complete! Processed {synced} users in {elapsed:.1f}s "
+          f"({synced / elapsed if elapsed else 0:.0f} users/s).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync the users table to Firestore")
+    parser.add_argument("--chunk-size", type=int, default=FIRESTORE_BATCH_LIMIT,
+                        help=f"users per batched read/write (max {FIRESTORE_BATCH_LIMIT})")
+    parser.add_argument("--workers", type=int, default=8, help="chunks synced concurrently")
+    parser.add_argument("--checkpoint", type=Path, default=Path(".sync_checkpoint.json"),
+                        help="file recording the last fully synced user id of an interrupted run")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and sync every user")
+    args = parser.parse_args()
+
+    sync(min(args.chunk_size, FIRESTORE_BATCH_LIMIT), max(args.workers, 1), args.checkpoint, args.restart)
@@ -0,0 +1,55 @@
+# backend/tests/conftest.py
+"""
+Imports the app against an in-memory SQLite database with the Firebase clients
+replaced by mocks, so the tests run without credentials or network access.
+
+    cd backend && python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["FIREBASE_CREDENTIALS"] = "{}"
+
+# main creates uploads/ in the working directory on import
+os.chdir(tempfile.mkdtemp(prefix="fightmatch-tests-"))
+
+with mock.patch("firebase_admin.credentials.Certificate"), \
+        mock.patch("firebase_admin.initialize_app"), \
+        mock.patch("firebase_admin.firestore.client"), \
+        mock.patch("firebase_admin.storage.bucket"):
+    import main
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(app_module):
+    from fastapi.testclient import TestClient
+    # Not used as a context manager, so the startup handlers (background workers) don't run
+    return TestClient(app_module.app)
+
+
+@pytest.fixture(scope="session")
+def register(client):
+    def register_user(username: str) -> tuple:
+        """Create a user and return (user id, auth headers)"""
+        response = client.post("/register", json={
+            "username": username, "email": f"{username}@example.com", "password": "password",
+            "full_name": username, "age": 25, "height": 180, "weight": 80, "location": "Tbilisi",
+            "bio": "", "martial_arts": ["BJJ"], "experience_years": 2, "skill_level": "Beginner",
+            "preferred_styles": ["BJJ"], "weight_class": "Lightweight"
+        })
+        assert response.status_code == 200, response.text
+        token = client.post("/token", data={"username": username, "password": "password"}).json()["access_token"]
+        return response.json()["id"], {"Authorization": f"Bearer {token}"}
+    return register_user
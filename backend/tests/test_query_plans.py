@@ -0,0 +1,87 @@
+# backend/tests/test_query_plans.py
+"""
+EXPLAIN the queries the hot routes actually issue and check that each one is
+served by an index rather than a full table scan. Statements are captured from
+real requests, so the audit follows the code instead of a hand-written copy.
+"""
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+
+@contextmanager
+def captured_statements(engine):
+    """Collect (sql, parameters) for every single-row statement run on the engine"""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+
+def table_scans(engine, statement: str, parameters) -> list:
+    with engine.connect() as conn:
+        plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+    # "SCAN swipes" is a full scan; "SCAN x USING INDEX" walks an index in order
+    return [line for line in plan if line.startswith("SCAN ") and " USING " not in line]
+
+
+@pytest.fixture(scope="module")
+def fighters(app_module, client, register):
+    """Two matched fighters with a fight, an achievement notification and a gallery photo"""
+    first_id, first_headers = register("plan_first")
+    second_id, second_headers = register("plan_second")
+    client.post("/swipe", json={"target_user_id": second_id, "is_like": True}, headers=first_headers)
+    client.post("/swipe", json={"target_user_id": first_id, "is_like": True}, headers=second_headers)
+    client.post("/fights/record", json={
+        "opponent_id": second_id, "result": "win", "martial_art_style": "BJJ"
+    }, headers=first_headers)
+
+    db = app_module.SessionLocal()
+    try:
+        db.add(app_module.PhotoGallery(user_id=first_id, photo_url="https://example.com/p.jpg", order_index=0))
+        db.commit()
+    finally:
+        db.close()
+
+    third_id, _ = register("plan_third")
+    return {"first": first_headers, "third_id": third_id}
+
+
+HOT_ROUTES = [
+    ("get_current_user", "GET", "/users/me"),
+    ("swipe", "POST", "/swipe"),
+    ("fight history", "GET", "/fights/history"),
+    ("achievement notifications", "GET", "/notifications/achievements?unread_only=true"),
+    ("gallery", "GET", "/users/me/gallery"),
+    ("matches", "GET", "/matches"),
+    ("unread matches", "GET", "/matches/unread"),
+    ("leaderboard", "GET", "/leaderboard"),
+]
+
+
+@pytest.mark.parametrize("name, method, path", HOT_ROUTES, ids=[route[0] for route in HOT_ROUTES])
+def test_hot_route_queries_use_indexes(app_module, client, fighters, name, method, path):
+    # Start cold so the primary-key lookup behind get_current_user is audited too
+    app_module.user_cache.clear()
+    app_module.match_cache.clear()
+
+    body = {"target_user_id": fighters["third_id"], "is_like": False} if path == "/swipe" else None
+    with captured_statements(app_module.engine) as statements:
+        response = client.request(method, path, json=body, headers=fighters["first"])
+    assert response.status_code == 200, response.text
+    assert statements, f"{name} issued no queries"
+
+    scans = {
+        statement: scans
+        for statement, parameters in statements
+        if (scans := table_scans(app_module.engine, statement, parameters))
+    }
+    assert not scans, f"{name} has full table scans: {scans}"
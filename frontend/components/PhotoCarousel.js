@@ -24,13 +24,16 @@ export default function PhotoCarousel({ userId, photos = [] }) {
     );
   }
 
+  // Card-sized variant is enough for the carousel; older photos only have the original
+  const currentUrl = photos[currentIndex].card_url || photos[currentIndex].photo_url;
+
   return (
     <div className="relative w-full h-80 overflow-hidden group">
       {/* Main Image */}
       <img
-        src={photos[currentIndex].photo_url.startsWith('http')
-          ? photos[currentIndex].photo_url
-          : `https://fightmatch-backend.onrender.com${photos[currentIndex].photo_url}`}
+        src={currentUrl.startsWith('http')
+          ? currentUrl
+          : `https://fightmatch-backend.onrender.com${currentUrl}`}
         alt="Profile"
         className="w-full h-full object-cover transition-opacity duration-300"
       />
@@ -124,9 +124,9 @@ export default function PhotoGalleryManager({ userId, isOwner = false }) {
             className="relative aspect-square rounded-xl overflow-hidden group bg-gray-800"
           >
             <img
-              src={photo.photo_url.startsWith('http')
-                ? photo.photo_url
-                : `https://fightmatch-backend.onrender.com${photo.photo_url}`}
+              src={(photo.thumbnail_url || photo.photo_url).startsWith('http')
+                ? (photo.thumbnail_url || photo.photo_url)
+                : `https://fightmatch-backend.onrender.com${photo.thumbnail_url || photo.photo_url}`}
               alt="Gallery"
               className="w-full h-full object-cover"
             />
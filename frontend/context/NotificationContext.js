@@ -60,17 +60,28 @@ export function NotificationProvider({ children }) {
     }
   };
 
-  // Poll for updates every 10 seconds
+  // Refresh when the server pushes a new match or achievement, with a slow poll as a fallback
   useEffect(() => {
     fetchUnreadMatches();
     fetchUnreadAchievements();
 
+    let events = null;
+    const token = localStorage.getItem('access_token');
+    if (token && typeof EventSource !== 'undefined') {
+      events = new EventSource(`https://fightmatch-backend.onrender.com/events?token=${encodeURIComponent(token)}`);
+      events.addEventListener('match', fetchUnreadMatches);
+      events.addEventListener('achievement', fetchUnreadAchievements);
+    }
+
     const interval = setInterval(() => {
       fetchUnreadMatches();
       fetchUnreadAchievements();
-    }, 10000);
+    }, 60000);
 
-    return () => clearInterval(interval);
+    return () => {
+      clearInterval(interval);
+      if (events) events.close();
+    };
   }, []);
 
   const markMatchesAsRead = () => {
@@ -17,6 +17,8 @@ export default function Discover() {
   const [filterCount, setFilterCount] = useState(0);
   const { fetchUnreadMatches } = useNotifications();
   const [userGalleries, setUserGalleries] = useState({}); // Store galleries for each user
+  const [nextCursor, setNextCursor] = useState(null); // Token for the next page of /users/discover
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     const token = localStorage.getItem('access_token');
@@ -91,6 +93,8 @@ export default function Discover() {
       const data = await response.json();
       setUsers(data);
       setCurrentIndex(0);
+      // Only the unfiltered endpoint is paginated
+      setNextCursor(hasActiveFilters ? null : response.headers.get('X-Next-Cursor'));
 
       console.log(`Loaded ${data.length} users for swiping`);
     } else {
@@ -103,6 +107,46 @@ export default function Discover() {
   }
 };
 
+  // Fetch the next page of fighters and append it to the deck
+  const fetchMoreUsers = async () => {
+    if (!nextCursor || loadingMore) return;
+
+    setLoadingMore(true);
+    try {
+      const token = localStorage.getItem('access_token');
+      const response = await fetch(
+        `https://fightmatch-backend.onrender.com/users/discover?cursor=${encodeURIComponent(nextCursor)}`,
+        {
+          headers: {
+            'Authorization': `Bearer ${token}`
+          }
+        }
+      );
+
+      if (response.ok) {
+        const data = await response.json();
+        setUsers(prev => {
+          const seen = new Set(prev.map(u => u.id));
+          return [...prev, ...data.filter(u => !seen.has(u.id))];
+        });
+        setNextCursor(response.headers.get('X-Next-Cursor'));
+      } else {
+        console.error('Failed to fetch more users');
+      }
+    } catch (error) {
+      console.error('Error fetching more users:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  // Load the next page when the deck runs low
+  useEffect(() => {
+    if (nextCursor && users.length - currentIndex <= 5) {
+      fetchMoreUsers();
+    }
+  }, [currentIndex, users.length, nextCursor]);
+
 // Call this on component mount to load ALL users by default
 useEffect(() => {
   fetchUsers(); // No filters = load everyone
@@ -249,7 +293,9 @@ useEffect(() => {
         )}
 
         {/* Card Display */}
-        {!currentUser ? (
+        {!currentUser && (nextCursor || loadingMore) ? (
+          <div className="text-center py-16 text-gray-400 text-xl">Loading more fighters...</div>
+        ) : !currentUser ? (
           <div className="text-center py-16">
             <div className="text-6xl mb-4">🥊</div>
             <p className="text-gray-400 text-xl mb-4">No more fighters to discover!</p>